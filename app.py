@@ -1,25 +1,46 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, stream_template, request, jsonify, redirect, url_for
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
 import json
-import uuid
+import secrets
+import itertools
+import time
+import threading
+from functools import lru_cache, wraps
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import pandas as pd
 import numpy as np
-from fraud_detection_model import FraudDetectionModel
-from database import FraudDatabase
+from fraud_detection_model import FraudDetectionModel, RISK_LABELS, RISK_THRESHOLDS
+from database import FraudDatabase, WriteBehindLogger
 import os
-from integrations.stripe_integration import StripeIntegration
-from integrations.fraud_databases import FraudDatabaseManager
+import tempfile
 from integrations.webhook_handlers import webhooks_bp
-from real_time_processor import RealTimeFraudProcessor
 from config import config
+
+try:
+    import orjson
+except ImportError:  # optional speedup; Flask's stdlib provider is used without it
+    orjson = None
 import os
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, with native NumPy serialization"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
 app.secret_key = 'fraud_detection_secret_key'
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 # Initialize fraud detection system
 fraud_detector = FraudDetectionModel()
-db = FraudDatabase()
+db = FraudDatabase(checkpoint_interval=config.WAL_CHECKPOINT_INTERVAL)
+write_logger = WriteBehindLogger(db)
 
 # Try to load pre-trained models
 try:
@@ -28,40 +49,139 @@ try:
 except:
     print("No pre-trained models found. Training new models...")
     # Generate and train on synthetic data
-    df = fraud_detector.generate_synthetic_data(n_samples=5000)
-    fraud_detector.train_models(df)
+    dataset = fraud_detector.generate_synthetic_data(n_samples=5000)
+    fraud_detector.train_models(dataset)
     fraud_detector.save_models()
     print("New models trained and saved!")
 
-# Initialize integrations
-stripe_integration = StripeIntegration()
-fraud_db_manager = FraudDatabaseManager()
+@lru_cache(maxsize=10_000)
+def _cached_predict(feature_tuple, model_type):
+    """Predict fraud for a canonical feature tuple, memoizing repeated vectors"""
+    # Call _cached_predict.cache_clear() whenever the models are reloaded
+    return fraud_detector.predict_fraud(dict(zip(fraud_detector.feature_columns, feature_tuple)), model_type)
+
+def predict_fraud_cached(transaction_data, model_type='ensemble'):
+    """Predict fraud, skipping model inference for previously seen feature vectors"""
+    feature_tuple = tuple(transaction_data.get(col, 0) for col in fraud_detector.feature_columns)
+    prediction = dict(_cached_predict(feature_tuple, model_type))
+    prediction['timestamp'] = datetime.now().isoformat()
+    return prediction
+
+def ttl_cached(ttl):
+    """Memoize a function's result per argument tuple for ttl seconds"""
+    def decorator(func):
+        cache = {}
+        lock = threading.Lock()
+        
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(args)
+            if entry and entry[0] > now:
+                return entry[1]
+            value = func(*args)
+            with lock:
+                cache[args] = (now + ttl, value)
+            return value
+        
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+# Aggregates for the dashboard and /api/stats need not be second-accurate
+@ttl_cached(5)
+def cached_fraud_statistics():
+    return db.get_fraud_statistics()
+
+@ttl_cached(5)
+def cached_fraud_trends(days):
+    return db.get_fraud_trends(days=days)
+
+# Shared pool for fanning out the dashboard's independent database reads
+dashboard_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='dashboard')
+
+# Integrations are created on first use so workers that never call them skip the setup cost
+@lru_cache(maxsize=None)
+def get_stripe_integration():
+    from integrations.stripe_integration import StripeIntegration
+    return StripeIntegration()
+
+@lru_cache(maxsize=None)
+def get_fraud_db_manager():
+    from integrations.fraud_databases import FraudDatabaseManager
+    return FraudDatabaseManager()
 
-# Initialize real-time processor if enabled
+# Initialize real-time processor if enabled, sharing the app's model and services
 real_time_processor = None
 if config.ENABLE_REAL_TIME_PROCESSING:
-    real_time_processor = RealTimeFraudProcessor()
+    from real_time_processor import RealTimeFraudProcessor
+    real_time_processor = RealTimeFraudProcessor(
+        fraud_detector=fraud_detector,
+        db=db,
+        stripe_integration=get_stripe_integration(),
+        fraud_db_manager=get_fraud_db_manager()
+    )
     real_time_processor.start()
     print("Real-time fraud processor started!")
 
-# Register webhook blueprint
-app.register_blueprint(webhooks_bp)
+# Register webhook blueprint; its handlers use the app's model, database and integrations
+app.register_blueprint(
+    webhooks_bp,
+    fraud_detector=fraud_detector,
+    db=db,
+    get_stripe_integration=get_stripe_integration,
+    get_fraud_db_manager=get_fraud_db_manager
+)
+
+# Cache compiled template bytecode across restarts and compile every page up front
+jinja_cache_dir = os.path.join(tempfile.gettempdir(), 'fraud_detection_jinja_cache')
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+for template_name in ['dashboard.html', 'analyze.html', 'transactions.html', 'alerts.html',
+                      'demo.html', 'config.html', 'integrations.html']:
+    app.jinja_env.get_template(template_name)
 
 @app.route('/')
 def dashboard():
     """Main dashboard showing fraud detection statistics"""
-    stats = db.get_fraud_statistics()
-    recent_transactions = db.get_recent_transactions(limit=10)
-    open_alerts = db.get_open_alerts()
+    # Run the aggregate queries concurrently; WAL mode lets the readers proceed in parallel
+    stats_future = dashboard_executor.submit(cached_fraud_statistics)
+    alerts_future = dashboard_executor.submit(db.get_open_alerts)
+    trends_future = dashboard_executor.submit(cached_fraud_trends, 7)  # last 7 days
+    stats, open_alerts, trends = stats_future.result(), alerts_future.result(), trends_future.result()
     
-    # Get fraud trends for the last 7 days
-    trends = db.get_fraud_trends(days=7)
-    
-    return render_template('dashboard.html', 
-                         stats=stats,
-                         recent_transactions=recent_transactions.to_dict('records'),
-                         open_alerts=open_alerts.to_dict('records'),
-                         trends=trends.to_dict('records'))
+    # Stream the page so transaction rows render as they are read from the database
+    return stream_template('dashboard.html', 
+                           stats=stats,
+                           recent_transactions=db.iter_recent_transactions(limit=10),
+                           open_alerts=open_alerts,
+                           trends=trends)
+
+# Transaction IDs are a per-process random prefix plus a counter, avoiding a urandom read per request
+_TXN_PREFIX = secrets.token_hex(4)
+_TXN_COUNTER = itertools.count()
+
+def _new_txn_id():
+    return f"TXN_{_TXN_PREFIX}{next(_TXN_COUNTER):04x}"
+
+# (field, type, default) for the numeric model features posted by the analyze form
+FORM_FIELD_SPEC = [
+    ('account_age_days', int, 30),
+    ('num_transactions_today', int, 1),
+    ('avg_transaction_amount', float, 100),
+    ('time_since_last_transaction', int, 60),
+    ('merchant_risk_score', float, 0.1),
+    ('location_risk_score', float, 0.1),
+    ('device_risk_score', float, 0.1),
+    ('velocity_score', float, 0.1),
+    ('amount_deviation', float, 0.5),
+    ('hour_of_day', int, 12),
+    ('day_of_week', int, 1),
+    ('is_weekend', int, 0),
+    ('cross_border', int, 0),
+    ('high_risk_merchant', int, 0)
+]
 
 @app.route('/analyze', methods=['GET', 'POST'])
 def analyze_transaction():
@@ -69,45 +189,34 @@ def analyze_transaction():
     if request.method == 'POST':
         try:
             # Get transaction data from form
+            form = request.form
+            amount = float(form.get('amount', 0))
             transaction_data = {
-                'transaction_id': request.form.get('transaction_id') or f"TXN_{uuid.uuid4().hex[:8]}",
-                'user_id': request.form.get('user_id'),
-                'amount': float(request.form.get('amount', 0)),
-                'merchant': request.form.get('merchant'),
-                'transaction_amount': float(request.form.get('amount', 0)),
-                'account_age_days': int(request.form.get('account_age_days', 30)),
-                'num_transactions_today': int(request.form.get('num_transactions_today', 1)),
-                'avg_transaction_amount': float(request.form.get('avg_transaction_amount', 100)),
-                'time_since_last_transaction': int(request.form.get('time_since_last_transaction', 60)),
-                'merchant_risk_score': float(request.form.get('merchant_risk_score', 0.1)),
-                'location_risk_score': float(request.form.get('location_risk_score', 0.1)),
-                'device_risk_score': float(request.form.get('device_risk_score', 0.1)),
-                'velocity_score': float(request.form.get('velocity_score', 0.1)),
-                'amount_deviation': float(request.form.get('amount_deviation', 0.5)),
-                'hour_of_day': int(request.form.get('hour_of_day', 12)),
-                'day_of_week': int(request.form.get('day_of_week', 1)),
-                'is_weekend': int(request.form.get('is_weekend', 0)),
-                'cross_border': int(request.form.get('cross_border', 0)),
-                'high_risk_merchant': int(request.form.get('high_risk_merchant', 0))
+                'transaction_id': form.get('transaction_id') or _new_txn_id(),
+                'user_id': form.get('user_id'),
+                'amount': amount,
+                'merchant': form.get('merchant'),
+                'transaction_amount': amount
             }
+            for field, caster, default in FORM_FIELD_SPEC:
+                transaction_data[field] = caster(form.get(field, default))
             
             # Get model type
-            model_type = request.form.get('model_type', 'ensemble')
+            model_type = form.get('model_type', 'ensemble')
             
             # Predict fraud
-            prediction = fraud_detector.predict_fraud(transaction_data, model_type)
-            
-            # Store in database
-            db.insert_transaction(transaction_data, prediction)
+            prediction = predict_fraud_cached(transaction_data, model_type)
             
-            # Create alert if high risk
+            # Queue for storage, with an alert if high risk
+            alert = None
             if prediction['risk_level'] == 'High':
-                db.create_fraud_alert(
+                alert = (
                     transaction_data['transaction_id'],
                     'High Risk Transaction',
                     'Critical',
                     f"Transaction flagged as high risk fraud (probability: {prediction['fraud_probability']:.2%})"
                 )
+            write_logger.log(transaction_data, prediction, alert)
             
             return render_template('analyze.html', 
                                  transaction=transaction_data,
@@ -120,6 +229,21 @@ def analyze_transaction():
     
     return render_template('analyze.html')
 
+# Default values for features missing from /api/analyze requests (time fields are filled per request)
+DEFAULT_FEATURES = {
+    'account_age_days': 30,
+    'num_transactions_today': 1,
+    'avg_transaction_amount': 100,
+    'time_since_last_transaction': 60,
+    'merchant_risk_score': 0.1,
+    'location_risk_score': 0.1,
+    'device_risk_score': 0.1,
+    'velocity_score': 0.1,
+    'amount_deviation': 0.5,
+    'cross_border': 0,
+    'high_risk_merchant': 0
+}
+
 @app.route('/api/analyze', methods=['POST'])
 def api_analyze():
     """API endpoint for fraud analysis"""
@@ -134,47 +258,32 @@ def api_analyze():
         
         # Add transaction ID if not provided
         if 'transaction_id' not in data:
-            data['transaction_id'] = f"TXN_{uuid.uuid4().hex[:8]}"
+            data['transaction_id'] = _new_txn_id()
         
         # Set default values for missing features
-        defaults = {
-            'account_age_days': 30,
-            'num_transactions_today': 1,
-            'avg_transaction_amount': 100,
-            'time_since_last_transaction': 60,
-            'merchant_risk_score': 0.1,
-            'location_risk_score': 0.1,
-            'device_risk_score': 0.1,
-            'velocity_score': 0.1,
-            'amount_deviation': 0.5,
-            'hour_of_day': datetime.now().hour,
-            'day_of_week': datetime.now().weekday(),
-            'is_weekend': 1 if datetime.now().weekday() >= 5 else 0,
-            'cross_border': 0,
-            'high_risk_merchant': 0
-        }
-        
-        for key, value in defaults.items():
-            if key not in data:
-                data[key] = value
+        now = datetime.now()
+        data.setdefault('hour_of_day', now.hour)
+        data.setdefault('day_of_week', now.weekday())
+        data.setdefault('is_weekend', 1 if now.weekday() >= 5 else 0)
+        for key, value in DEFAULT_FEATURES.items():
+            data.setdefault(key, value)
         
         # Ensure transaction_amount is set
         data['transaction_amount'] = data['amount']
         
         # Predict fraud
-        prediction = fraud_detector.predict_fraud(data)
+        prediction = predict_fraud_cached(data)
         
-        # Store in database
-        db.insert_transaction(data, prediction)
-        
-        # Create alert if high risk
+        # Queue for storage, with an alert if high risk
+        alert = None
         if prediction['risk_level'] == 'High':
-            db.create_fraud_alert(
+            alert = (
                 data['transaction_id'],
                 'High Risk Transaction',
                 'Critical',
                 f"Transaction flagged as high risk fraud (probability: {prediction['fraud_probability']:.2%})"
             )
+        write_logger.log(data, prediction, alert)
         
         return jsonify({
             'transaction_id': data['transaction_id'],
@@ -189,24 +298,24 @@ def api_analyze():
 def alerts():
     """View fraud alerts"""
     open_alerts = db.get_open_alerts()
-    return render_template('alerts.html', alerts=open_alerts.to_dict('records'))
+    return render_template('alerts.html', alerts=open_alerts)
 
 @app.route('/transactions')
 def transactions():
     """View recent transactions"""
     recent_transactions = db.get_recent_transactions(limit=50)
     return render_template('transactions.html', 
-                         transactions=recent_transactions.to_dict('records'))
+                         transactions=recent_transactions)
 
 @app.route('/api/stats')
 def api_stats():
     """API endpoint for fraud statistics"""
-    stats = db.get_fraud_statistics()
-    trends = db.get_fraud_trends(days=7)
+    stats = cached_fraud_statistics()
+    trends = cached_fraud_trends(7)
     
     return jsonify({
         'statistics': stats,
-        'trends': trends.to_dict('records')
+        'trends': trends
     })
 
 @app.route('/demo')
@@ -244,11 +353,15 @@ def demo():
     
     return render_template('demo.html', sample_transactions=sample_transactions)
 
+# Configuration is fixed once the process starts, so summarize and validate it once
+_CONFIG_SUMMARY = config.get_config_summary()
+_CONFIG_VALIDATION = config.validate_config()
+
 @app.route('/config')
 def config_status():
     """Show configuration status"""
-    config_summary = config.get_config_summary()
-    validation_results = config.validate_config()
+    config_summary = _CONFIG_SUMMARY
+    validation_results = _CONFIG_VALIDATION
     
     return render_template('config.html', 
                          config_summary=config_summary,
@@ -262,7 +375,7 @@ def integrations():
     # Get Stripe data if configured
     if config.STRIPE_SECRET_KEY:
         try:
-            recent_charges = stripe_integration.get_recent_charges(limit=10, hours_back=24)
+            recent_charges = get_stripe_integration().get_recent_charges(limit=10, hours_back=24)
             integration_data['stripe'] = {
                 'status': 'connected',
                 'recent_charges': len(recent_charges),
@@ -290,12 +403,11 @@ def sync_stripe_data():
     
     try:
         hours_back = request.json.get('hours_back', 24) if request.is_json else 24
-        recent_charges = stripe_integration.get_recent_charges(limit=100, hours_back=hours_back)
+        recent_charges = get_stripe_integration().get_recent_charges(limit=100, hours_back=hours_back)
         
-        processed_count = 0
-        for charge_data in recent_charges:
-            # Convert to our transaction format
-            transaction_data = {
+        # Convert to our transaction format
+        transactions = [
+            {
                 'transaction_id': charge_data['transaction_id'],
                 'user_id': charge_data.get('customer_info', {}).get('customer_id', 'unknown'),
                 'amount': charge_data['amount'],
@@ -304,21 +416,47 @@ def sync_stripe_data():
                 'payment_processor': 'stripe',
                 'timestamp': charge_data['created'].isoformat()
             }
-            
-            # Analyze with fraud detection
-            fraud_prediction = fraud_detector.predict_fraud(transaction_data)
-            
-            # Analyze with external databases
-            external_analysis = fraud_db_manager.analyze_transaction(transaction_data)
-            
-            # Combine results
-            combined_score = (fraud_prediction['fraud_probability'] + external_analysis['combined_risk_score']) / 2
+            for charge_data in recent_charges
+            if not db.is_known_transaction(charge_data['transaction_id'])
+        ]
+        if not transactions:
+            return jsonify({
+                'status': 'success',
+                'processed_count': 0,
+                'message': 'Synced 0 Stripe transactions'
+            })
+        
+        # Analyze with fraud detection in a single vectorized call
+        fraud_predictions = fraud_detector.predict_fraud_batch(transactions)
+        
+        # Analyze with external databases
+        external_analyses = get_fraud_db_manager().analyze_transactions_batch(transactions)
+        
+        # Combine results and bucket them into risk levels across the whole batch
+        model_probs = np.array([prediction['fraud_probability'] for prediction in fraud_predictions])
+        external_scores = np.array([analysis['combined_risk_score'] for analysis in external_analyses])
+        combined_scores = (model_probs + external_scores) / 2
+        risk_levels = RISK_LABELS[np.searchsorted(RISK_THRESHOLDS, combined_scores, side='left')]
+        
+        tx_rows = []
+        alert_rows = []
+        for transaction_data, fraud_prediction, combined_score, risk_level in zip(
+                transactions, fraud_predictions, combined_scores.tolist(), risk_levels.tolist()):
             fraud_prediction['fraud_probability'] = combined_score
-            fraud_prediction['risk_level'] = 'High' if combined_score > 0.7 else 'Medium' if combined_score > 0.3 else 'Low'
+            fraud_prediction['risk_level'] = risk_level
             
-            # Store in database
-            db.insert_transaction(transaction_data, fraud_prediction)
-            processed_count += 1
+            tx_rows.append((transaction_data, fraud_prediction))
+            if fraud_prediction['risk_level'] == 'High':
+                alert_rows.append((
+                    transaction_data['transaction_id'],
+                    'High Risk Stripe Transaction',
+                    'Critical',
+                    f"Stripe transaction flagged as high risk (score: {combined_score:.2%})"
+                ))
+        
+        # Store all synced transactions and alerts in a single commit; rows another writer
+        # stored since the is_known_transaction check are skipped and not counted
+        processed_count = db.insert_transactions_bulk(tx_rows, alert_rows)
         
         return jsonify({
             'status': 'success',
@@ -330,329 +468,6 @@ def sync_stripe_data():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    # Create templates directory and basic templates if they don't exist
-    os.makedirs('templates', exist_ok=True)
-    
-    # Create a simple base template
-    base_template = '''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI Fraud Detection System</title>
-    <style>
-        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; background-color: #f5f5f5; }
-        .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header { background: #2c3e50; color: white; padding: 20px; margin: -20px -20px 20px -20px; border-radius: 8px 8px 0 0; }
-        .nav { margin: 20px 0; }
-        .nav a { margin-right: 20px; color: #3498db; text-decoration: none; }
-        .nav a:hover { text-decoration: underline; }
-        .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin: 20px 0; }
-        .stat-card { background: #ecf0f1; padding: 20px; border-radius: 8px; text-align: center; }
-        .stat-value { font-size: 2em; font-weight: bold; color: #2c3e50; }
-        .stat-label { color: #7f8c8d; margin-top: 5px; }
-        .form-group { margin: 15px 0; }
-        .form-group label { display: block; margin-bottom: 5px; font-weight: bold; }
-        .form-group input, .form-group select { width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
-        .btn { background: #3498db; color: white; padding: 10px 20px; border: none; border-radius: 4px; cursor: pointer; }
-        .btn:hover { background: #2980b9; }
-        .alert { padding: 15px; margin: 10px 0; border-radius: 4px; }
-        .alert-success { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
-        .alert-danger { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
-        .alert-warning { background: #fff3cd; color: #856404; border: 1px solid #ffeaa7; }
-        .table { width: 100%; border-collapse: collapse; margin: 20px 0; }
-        .table th, .table td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-        .table th { background: #f8f9fa; font-weight: bold; }
-        .risk-high { color: #e74c3c; font-weight: bold; }
-        .risk-medium { color: #f39c12; font-weight: bold; }
-        .risk-low { color: #27ae60; font-weight: bold; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🛡️ AI-Powered Fraud Detection System</h1>
-            <p>Real-time fraud detection with machine learning and behavioral biometrics</p>
-        </div>
-        
-        <div class="nav">
-            <a href="/">Dashboard</a>
-            <a href="/analyze">Analyze Transaction</a>
-            <a href="/transactions">Transactions</a>
-            <a href="/alerts">Alerts</a>
-            <a href="/demo">Demo</a>
-        </div>
-        
-        {% block content %}{% endblock %}
-    </div>
-</body>
-</html>'''
-    
-    with open('templates/base.html', 'w') as f:
-        f.write(base_template)
-    
-    # Dashboard template
-    dashboard_template = '''{% extends "base.html" %}
-{% block content %}
-<h2>📊 Fraud Detection Dashboard</h2>
-
-<div class="stats">
-    <div class="stat-card">
-        <div class="stat-value">{{ stats.total_transactions }}</div>
-        <div class="stat-label">Total Transactions</div>
-    </div>
-    <div class="stat-card">
-        <div class="stat-value">{{ "%.1f"|format(stats.fraud_rate) }}%</div>
-        <div class="stat-label">Fraud Rate</div>
-    </div>
-    <div class="stat-card">
-        <div class="stat-value">{{ stats.high_risk_transactions }}</div>
-        <div class="stat-label">High Risk Transactions</div>
-    </div>
-    <div class="stat-card">
-        <div class="stat-value">{{ stats.open_alerts }}</div>
-        <div class="stat-label">Open Alerts</div>
-    </div>
-</div>
-
-<h3>🔍 Recent Transactions</h3>
-<table class="table">
-    <thead>
-        <tr>
-            <th>Transaction ID</th>
-            <th>User ID</th>
-            <th>Amount</th>
-            <th>Fraud Probability</th>
-            <th>Risk Level</th>
-            <th>Timestamp</th>
-        </tr>
-    </thead>
-    <tbody>
-        {% for transaction in recent_transactions %}
-        <tr>
-            <td>{{ transaction.transaction_id }}</td>
-            <td>{{ transaction.user_id }}</td>
-            <td>${{ "%.2f"|format(transaction.amount) }}</td>
-            <td>{{ "%.1f"|format(transaction.fraud_probability * 100) }}%</td>
-            <td class="risk-{{ transaction.risk_level.lower() }}">{{ transaction.risk_level }}</td>
-            <td>{{ transaction.timestamp }}</td>
-        </tr>
-        {% endfor %}
-    </tbody>
-</table>
-
-<h3>🚨 Recent Alerts</h3>
-{% if open_alerts %}
-<table class="table">
-    <thead>
-        <tr>
-            <th>Transaction ID</th>
-            <th>Alert Type</th>
-            <th>Severity</th>
-            <th>Amount</th>
-            <th>Fraud Probability</th>
-            <th>Created</th>
-        </tr>
-    </thead>
-    <tbody>
-        {% for alert in open_alerts %}
-        <tr>
-            <td>{{ alert.transaction_id }}</td>
-            <td>{{ alert.alert_type }}</td>
-            <td class="risk-{{ alert.severity.lower() }}">{{ alert.severity }}</td>
-            <td>${{ "%.2f"|format(alert.amount) }}</td>
-            <td>{{ "%.1f"|format(alert.fraud_probability * 100) }}%</td>
-            <td>{{ alert.created_at }}</td>
-        </tr>
-        {% endfor %}
-    </tbody>
-</table>
-{% else %}
-<div class="alert alert-success">No open alerts - all transactions are within normal parameters.</div>
-{% endif %}
-{% endblock %}'''
-    
-    with open('templates/dashboard.html', 'w') as f:
-        f.write(dashboard_template)
-    
-    # Analyze template
-    analyze_template = '''{% extends "base.html" %}
-{% block content %}
-<h2>🔍 Analyze Transaction</h2>
-
-{% if error %}
-<div class="alert alert-danger">{{ error }}</div>
-{% endif %}
-
-{% if analyzed %}
-<div class="alert alert-{{ 'danger' if prediction.is_fraud else 'success' }}">
-    <h3>Analysis Results</h3>
-    <p><strong>Transaction ID:</strong> {{ transaction.transaction_id }}</p>
-    <p><strong>Fraud Detected:</strong> {{ "Yes" if prediction.is_fraud else "No" }}</p>
-    <p><strong>Fraud Probability:</strong> {{ "%.1f"|format(prediction.fraud_probability * 100) }}%</p>
-    <p><strong>Risk Level:</strong> <span class="risk-{{ prediction.risk_level.lower() }}">{{ prediction.risk_level }}</span></p>
-</div>
-{% endif %}
-
-<form method="POST">
-    <h3>Transaction Details</h3>
-    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 20px;">
-        <div>
-            <div class="form-group">
-                <label>Transaction ID (optional):</label>
-                <input type="text" name="transaction_id" placeholder="Auto-generated if empty">
-            </div>
-            <div class="form-group">
-                <label>User ID:</label>
-                <input type="text" name="user_id" required placeholder="USER_123">
-            </div>
-            <div class="form-group">
-                <label>Amount ($):</label>
-                <input type="number" name="amount" step="0.01" required placeholder="100.00">
-            </div>
-            <div class="form-group">
-                <label>Merchant:</label>
-                <input type="text" name="merchant" placeholder="Store Name">
-            </div>
-            <div class="form-group">
-                <label>Account Age (days):</label>
-                <input type="number" name="account_age_days" value="30" min="1">
-            </div>
-            <div class="form-group">
-                <label>Transactions Today:</label>
-                <input type="number" name="num_transactions_today" value="1" min="1">
-            </div>
-            <div class="form-group">
-                <label>Average Transaction Amount ($):</label>
-                <input type="number" name="avg_transaction_amount" step="0.01" value="100.00">
-            </div>
-            <div class="form-group">
-                <label>Time Since Last Transaction (minutes):</label>
-                <input type="number" name="time_since_last_transaction" value="60">
-            </div>
-        </div>
-        <div>
-            <div class="form-group">
-                <label>Merchant Risk Score (0-1):</label>
-                <input type="number" name="merchant_risk_score" step="0.1" value="0.1" min="0" max="1">
-            </div>
-            <div class="form-group">
-                <label>Location Risk Score (0-1):</label>
-                <input type="number" name="location_risk_score" step="0.1" value="0.1" min="0" max="1">
-            </div>
-            <div class="form-group">
-                <label>Device Risk Score (0-1):</label>
-                <input type="number" name="device_risk_score" step="0.1" value="0.1" min="0" max="1">
-            </div>
-            <div class="form-group">
-                <label>Hour of Day (0-23):</label>
-                <input type="number" name="hour_of_day" value="12" min="0" max="23">
-            </div>
-            <div class="form-group">
-                <label>Day of Week (0-6):</label>
-                <input type="number" name="day_of_week" value="1" min="0" max="6">
-            </div>
-            <div class="form-group">
-                <label>Is Weekend:</label>
-                <select name="is_weekend">
-                    <option value="0">No</option>
-                    <option value="1">Yes</option>
-                </select>
-            </div>
-            <div class="form-group">
-                <label>Cross Border:</label>
-                <select name="cross_border">
-                    <option value="0">No</option>
-                    <option value="1">Yes</option>
-                </select>
-            </div>
-            <div class="form-group">
-                <label>High Risk Merchant:</label>
-                <select name="high_risk_merchant">
-                    <option value="0">No</option>
-                    <option value="1">Yes</option>
-                </select>
-            </div>
-        </div>
-    </div>
-    
-    <div class="form-group">
-        <label>Model Type:</label>
-        <select name="model_type">
-            <option value="ensemble">Ensemble (RF + SVM)</option>
-            <option value="rf">Random Forest</option>
-            <option value="svm">Support Vector Machine</option>
-        </select>
-    </div>
-    
-    <button type="submit" class="btn">Analyze Transaction</button>
-</form>
-{% endblock %}'''
-    
-    with open('templates/analyze.html', 'w') as f:
-        f.write(analyze_template)
-    
-    # Demo template
-    demo_template = '''{% extends "base.html" %}
-{% block content %}
-<h2>🎯 Demo - Sample Transactions</h2>
-
-<p>Try these pre-configured sample transactions to see the fraud detection system in action:</p>
-
-{% for sample in sample_transactions %}
-<div class="alert alert-{{ 'warning' if 'Suspicious' in sample.name else 'success' if 'Normal' in sample.name else 'danger' }}">
-    <h3>{{ sample.name }}</h3>
-    <form method="POST" action="/analyze" style="display: inline;">
-        <input type="hidden" name="amount" value="{{ sample.amount }}">
-        <input type="hidden" name="merchant" value="{{ sample.merchant }}">
-        <input type="hidden" name="account_age_days" value="{{ sample.account_age_days }}">
-        <input type="hidden" name="merchant_risk_score" value="{{ sample.merchant_risk_score }}">
-        <input type="hidden" name="cross_border" value="{{ sample.cross_border }}">
-        <input type="hidden" name="high_risk_merchant" value="{{ sample.high_risk_merchant }}">
-        <input type="hidden" name="user_id" value="DEMO_USER">
-        
-        <p><strong>Amount:</strong> ${{ sample.amount }} | <strong>Merchant:</strong> {{ sample.merchant }}</p>
-        <button type="submit" class="btn">Analyze This Transaction</button>
-    </form>
-</div>
-{% endfor %}
-
-<h3>📡 API Usage Example</h3>
-<div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-    <h4>POST /api/analyze</h4>
-    <pre style="background: #2c3e50; color: white; padding: 15px; border-radius: 4px; overflow-x: auto;">
-curl -X POST http://localhost:5000/api/analyze \\
-  -H "Content-Type: application/json" \\
-  -d '{
-    "user_id": "USER_123",
-    "amount": 1500.0,
-    "merchant": "Online Store",
-    "account_age_days": 30,
-    "merchant_risk_score": 0.7,
-    "cross_border": 1
-  }'</pre>
-</div>
-
-<h3>🔧 System Features</h3>
-<div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); gap: 20px; margin: 20px 0;">
-    <div class="stat-card">
-        <h4>🤖 Machine Learning</h4>
-        <p>Random Forest and SVM algorithms with ensemble prediction for 90%+ accuracy</p>
-    </div>
-    <div class="stat-card">
-        <h4>⚡ Real-time Detection</h4>
-        <p>Instant fraud scoring with risk level classification and automated alerts</p>
-    </div>
-    <div class="stat-card">
-        <h4>📊 Analytics Dashboard</h4>
-        <p>Comprehensive fraud statistics, trends analysis, and transaction monitoring</p>
-    </div>
-</div>
-{% endblock %}'''
-    
-    with open('templates/demo.html', 'w') as f:
-        f.write(demo_template)
-    
     print("Flask app starting...")
     print("Visit http://localhost:5000 to access the fraud detection dashboard")
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,9 +1,26 @@
 import os
+from functools import lru_cache
 from typing import Dict, Optional
 
 class FraudDetectionConfig:
     """Configuration management for fraud detection system"""
     
+    # Fixed attribute set: slot access is faster and typos raise instead of silently adding attributes
+    __slots__ = (
+        'DATABASE_URL', 'FRAUD_INTELLIGENCE_DB', 'WAL_CHECKPOINT_INTERVAL',
+        'STRIPE_SECRET_KEY', 'STRIPE_PUBLISHABLE_KEY',
+        'STRIPE_WEBHOOK_SECRET', 'PAYPAL_CLIENT_ID', 'PAYPAL_CLIENT_SECRET', 'PAYPAL_SANDBOX',
+        'PAYPAL_WEBHOOK_ID',
+        'MAXMIND_ACCOUNT_ID', 'MAXMIND_LICENSE_KEY', 'SIFT_API_KEY', 'FRAUD_ALERT_WEBHOOK_URL',
+        'FRAUD_ALERT_EMAIL', 'EMAIL_SMTP_SERVER', 'EMAIL_SMTP_PORT', 'EMAIL_USERNAME',
+        'EMAIL_PASSWORD', 'ENABLE_REAL_TIME_PROCESSING', 'MAX_PROCESSING_THREADS',
+        'MAX_ALERT_THREADS', 'BATCH_SIZE', 'PROCESSING_INTERVAL', 'LOW_RISK_THRESHOLD',
+        'HIGH_RISK_THRESHOLD', 'MODEL_UPDATE_INTERVAL_HOURS', 'MIN_TRAINING_SAMPLES',
+        'MAXMIND_RATE_LIMIT', 'SIFT_RATE_LIMIT', 'LOG_LEVEL', 'LOG_FILE',
+        'ENABLE_BEHAVIORAL_BIOMETRICS', 'ENABLE_EXTERNAL_FRAUD_CHECKS',
+        'ENABLE_IP_GEOLOCATION',
+    )
+    
     def __init__(self):
         self.load_config()
     
@@ -13,6 +30,8 @@ class FraudDetectionConfig:
         # Database Configuration
         self.DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///fraud_detection.db')
         self.FRAUD_INTELLIGENCE_DB = os.getenv('FRAUD_INTELLIGENCE_DB', 'fraud_intelligence.db')
+        # Seconds between background WAL checkpoints (0 = leave checkpointing to SQLite)
+        self.WAL_CHECKPOINT_INTERVAL = int(os.getenv('WAL_CHECKPOINT_INTERVAL', '0'))
         
         # Stripe Configuration
         self.STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
@@ -23,6 +42,7 @@ class FraudDetectionConfig:
         self.PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID')
         self.PAYPAL_CLIENT_SECRET = os.getenv('PAYPAL_CLIENT_SECRET')
         self.PAYPAL_SANDBOX = os.getenv('PAYPAL_SANDBOX', 'true').lower() == 'true'
+        self.PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID')
         
         # MaxMind Configuration
         self.MAXMIND_ACCOUNT_ID = os.getenv('MAXMIND_ACCOUNT_ID')
@@ -122,5 +142,10 @@ class FraudDetectionConfig:
             }
         }
 
+@lru_cache(maxsize=1)
+def get_config() -> FraudDetectionConfig:
+    """Return the process-wide configuration, parsing the environment only once"""
+    return FraudDetectionConfig()
+
 # Global configuration instance
-config = FraudDetectionConfig()
+config = get_config()
@@ -1,18 +1,152 @@
 import sqlite3
 import json
+import time
+import atexit
+import threading
+import hashlib
+import math
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+from queue import Queue, Empty
 from datetime import datetime
-import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # optional speedup; features are encoded with the json module without it
+    orjson = None
+
+# Shared statement text so SQLite's per-connection statement cache is hit on every insert
+INSERT_TXN_SQL = '''
+    INSERT INTO transactions 
+    (transaction_id, user_id, amount, merchant, is_fraud, 
+     fraud_probability, risk_level, features)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_TXN_IGNORE_SQL = INSERT_TXN_SQL.replace('INSERT INTO', 'INSERT OR IGNORE INTO')
+INSERT_ALERT_SQL = '''
+    INSERT INTO fraud_alerts (transaction_id, alert_type, severity, message)
+    VALUES (?, ?, ?, ?)
+'''
+
+def _encode_features(transaction_data):
+    """Serialize a transaction dict for the features column"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(transaction_data, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+        except TypeError:
+            pass  # e.g. non-string keys, which the json module still accepts
+    return json.dumps(transaction_data)
+
+class TransactionIdFilter:
+    """Bloom filter over transaction IDs; a hit must still be confirmed against the table"""
+    # A miss lets an insert go ahead, leaving anything it got wrong to the UNIQUE constraint;
+    # a bit lost to racing adds has the same effect
+    
+    def __init__(self, capacity=100_000, error_rate=1e-4):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+    
+    def _positions(self, transaction_id):
+        digest = hashlib.blake2b(str(transaction_id).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def add(self, transaction_id):
+        for pos in self._positions(transaction_id):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, transaction_id):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(transaction_id))
+
+class _SeenTransactionIds:
+    """Bloom filter over every stored transaction ID, shared by the FraudDatabases on one file"""
+    
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        # Only used under the lock, so whichever thread triggers a rebuild may run it
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._rebuild()
+    
+    def _rebuild(self):
+        # Sized with room to double before the false-positive rate degrades
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM transactions').fetchone()
+        seen = TransactionIdFilter(capacity=max(100_000, 2 * count))
+        for (transaction_id,) in self._conn.execute('SELECT transaction_id FROM transactions'):
+            seen.add(transaction_id)
+        self._filter, self._count = seen, count
+    
+    def add(self, transaction_id):
+        with self._lock:
+            self._filter.add(transaction_id)
+            self._count += 1
+            if self._count > self._filter.capacity:
+                self._rebuild()
+    
+    def __contains__(self, transaction_id):
+        return transaction_id in self._filter
+
+@lru_cache(maxsize=None)
+def get_seen_transaction_ids(db_path):
+    """Return the process-wide transaction ID filter for this database file"""
+    return _SeenTransactionIds(db_path)
 
 class FraudDatabase:
-    def __init__(self, db_path='fraud_detection.db'):
+    def __init__(self, db_path='fraud_detection.db', checkpoint_interval=0):
         self.db_path = db_path
+        # Seconds between background WAL checkpoints; 0 leaves checkpointing to SQLite
+        self.checkpoint_interval = checkpoint_interval
+        self._local = threading.local()
         self.init_database()
+        self._seen_ids = get_seen_transaction_ids(os.path.abspath(db_path))
+        
+        if checkpoint_interval:
+            self._checkpoint_thread = threading.Thread(target=self._checkpoint_loop, daemon=True)
+            self._checkpoint_thread.start()
+    
+    def _connect(self):
+        """Return this thread's long-lived connection, opening it on first use"""
+        # Kept open so SQLite's page and statement caches stay warm across queries
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA mmap_size=268435456')
+            conn.execute('PRAGMA cache_size=-65536')  # 64 MB page cache per connection
+            if self.checkpoint_interval:
+                # Commits only append to the WAL; the checkpoint thread copies it back
+                conn.execute('PRAGMA wal_autocheckpoint=0')
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def txn(self):
+        """Run a block on this thread's connection as one transaction, rolled back if it raises"""
+        conn = self._connect()
+        with conn:
+            yield conn
+    
+    def _checkpoint_loop(self):
+        """Periodically fold the WAL back into the database file off the write path"""
+        while True:
+            time.sleep(self.checkpoint_interval)
+            try:
+                self._connect().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                print(f"WAL checkpoint failed: {e}")
     
     def init_database(self):
         """Initialize the SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # WAL lets dashboard readers run alongside writers; the mode persists in the file
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Create transactions table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS transactions (
@@ -62,59 +196,157 @@ class FraudDatabase:
             )
         ''')
         
+        # Charges accepted by the Stripe webhook but not yet scored; rows are removed once the
+        # result is stored, so anything left here is requeued after a restart
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pending_charges (
+                charge_id TEXT PRIMARY KEY,
+                event_id TEXT,
+                payload TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Indexes for the dashboard queries; the partial ones only cover the rows those queries read
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_timestamp ON transactions(timestamp DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_risk ON transactions(risk_level)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_fraud ON transactions(is_fraud) WHERE is_fraud = 1')
+        # Day buckets for the trends query; also covers the aggregated columns so rows are never visited
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tx_date_bucket
+            ON transactions(DATE(timestamp), is_fraud, fraud_probability)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_alerts_open ON fraud_alerts(status, created_at DESC)
+            WHERE status = 'open'
+        ''')
+        
         conn.commit()
-        conn.close()
         print("Database initialized successfully!")
     
+    def is_known_transaction(self, transaction_id):
+        """Return True if the transaction ID is already stored"""
+        # Always a lookup: the Bloom filter misses IDs stored by other processes
+        row = self._connect().execute(
+            'SELECT 1 FROM transactions WHERE transaction_id = ? LIMIT 1', (transaction_id,)
+        ).fetchone()
+        return row is not None
+    
+    def _maybe_stored(self, transaction_id):
+        """Insert-path duplicate check that skips the lookup on a Bloom filter miss"""
+        # A miss can be wrong for IDs stored elsewhere; the UNIQUE constraint still catches those
+        return transaction_id in self._seen_ids and self.is_known_transaction(transaction_id)
+    
     def insert_transaction(self, transaction_data, prediction_result):
         """Insert a new transaction with fraud prediction results"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        transaction_id = transaction_data.get('transaction_id')
+        
+        if self._maybe_stored(transaction_id):
+            print(f"Transaction already exists: {transaction_id}")
+            return None
         
         try:
-            cursor.execute('''
-                INSERT INTO transactions 
-                (transaction_id, user_id, amount, merchant, is_fraud, 
-                 fraud_probability, risk_level, features)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                transaction_data.get('transaction_id'),
-                transaction_data.get('user_id'),
-                transaction_data.get('amount'),
-                transaction_data.get('merchant', 'Unknown'),
-                1 if prediction_result['is_fraud'] else 0,
-                prediction_result['fraud_probability'],
-                prediction_result['risk_level'],
-                json.dumps(transaction_data)
-            ))
-            
-            conn.commit()
+            with self.txn() as conn:
+                cursor = conn.execute(INSERT_TXN_SQL, self._transaction_row(transaction_data, prediction_result))
+            self._seen_ids.add(transaction_id)
             return cursor.lastrowid
         except sqlite3.IntegrityError as e:
             print(f"Transaction already exists: {e}")
             return None
-        finally:
-            conn.close()
+    
+    def insert_transaction_and_maybe_alert(self, transaction_data, prediction_result,
+                                           alert_type='High Risk Transaction', severity='Critical',
+                                           message=None):
+        """Insert a transaction and, if it is high risk, its fraud alert in one commit"""
+        transaction_id = transaction_data.get('transaction_id')
+        
+        if self._maybe_stored(transaction_id):
+            print(f"Transaction already exists: {transaction_id}")
+            return None
+        
+        try:
+            with self.txn() as conn:
+                cursor = conn.execute(INSERT_TXN_SQL, self._transaction_row(transaction_data, prediction_result))
+                if prediction_result['risk_level'] == 'High':
+                    if message is None:
+                        message = (f"Transaction flagged as high risk fraud "
+                                   f"(probability: {prediction_result['fraud_probability']:.2%})")
+                    conn.execute(INSERT_ALERT_SQL, (transaction_id, alert_type, severity, message))
+            self._seen_ids.add(transaction_id)
+            return cursor.lastrowid
+        except sqlite3.IntegrityError as e:
+            print(f"Transaction already exists: {e}")
+            return None
+    
+    def insert_transactions_bulk(self, rows, alerts=None):
+        """Insert (transaction_data, prediction_result) pairs and their alerts in one commit"""
+        # Alerts are (transaction_id, alert_type, severity, message); duplicate transaction IDs
+        # are skipped along with their alerts, and the inserted count is returned
+        inserted_ids = set()
+        with self.txn() as conn:
+            # Row by row so each OR IGNORE outcome is known; the statement is cached either way
+            for transaction_data, prediction_result in rows:
+                cursor = conn.execute(INSERT_TXN_IGNORE_SQL,
+                                      self._transaction_row(transaction_data, prediction_result))
+                if cursor.rowcount:
+                    inserted_ids.add(transaction_data.get('transaction_id'))
+            
+            if alerts:
+                conn.executemany(INSERT_ALERT_SQL,
+                                 [alert for alert in alerts if alert[0] in inserted_ids])
+        
+        for transaction_id in inserted_ids:
+            self._seen_ids.add(transaction_id)
+        return len(inserted_ids)
+    
+    def _transaction_row(self, transaction_data, prediction_result):
+        """Build the parameter tuple for a transactions INSERT"""
+        return (
+            transaction_data.get('transaction_id'),
+            transaction_data.get('user_id'),
+            transaction_data.get('amount'),
+            transaction_data.get('merchant', 'Unknown'),
+            1 if prediction_result['is_fraud'] else 0,
+            prediction_result['fraud_probability'],
+            prediction_result['risk_level'],
+            _encode_features(transaction_data)
+        )
     
     
     def create_fraud_alert(self, transaction_id, alert_type, severity, message):
         """Create a fraud alert for high-risk transactions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO fraud_alerts (transaction_id, alert_type, severity, message)
-            VALUES (?, ?, ?, ?)
-        ''', (transaction_id, alert_type, severity, message))
-        
-        conn.commit()
-        conn.close()
+        with self.txn() as conn:
+            conn.execute(INSERT_ALERT_SQL, (transaction_id, alert_type, severity, message))
+    
+    def save_pending_charge(self, charge_id, event_id, payload):
+        """Persist a charge queued for background scoring until its result is stored"""
+        with self.txn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO pending_charges (charge_id, event_id, payload) VALUES (?, ?, ?)',
+                (charge_id, event_id, payload)
+            )
+    
+    def delete_pending_charges(self, charge_ids):
+        """Drop charges whose scoring results have been stored"""
+        with self.txn() as conn:
+            conn.executemany('DELETE FROM pending_charges WHERE charge_id = ?',
+                             [(charge_id,) for charge_id in charge_ids])
+    
+    def get_pending_charges(self, min_age=0):
+        """Return charges waiting at least min_age seconds to be scored, oldest first"""
+        return self._fetch_dicts('''
+            SELECT charge_id, event_id, payload FROM pending_charges
+            WHERE created_at <= datetime('now', ?)
+            ORDER BY created_at
+        ''', (f'-{int(min_age)} seconds',))
     
     def get_recent_transactions(self, limit=100):
         """Get recent transactions with fraud predictions"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
+        return list(self.iter_recent_transactions(limit))
+    
+    def iter_recent_transactions(self, limit=100):
+        """Yield recent transactions one row at a time, for streamed rendering"""
+        return self._iter_dicts('''
             SELECT 
                 transaction_id,
                 user_id,
@@ -127,37 +359,29 @@ class FraudDatabase:
             FROM transactions 
             ORDER BY timestamp DESC 
             LIMIT ?
-        ''', conn, params=(limit,))
-        
-        conn.close()
-        return df
+        ''', (limit,))
+    
+    def iter_user_totals(self):
+        """Yield (user_id, transaction_count, total_amount, fraud_count) for every user"""
+        return self._connect().execute('''
+            SELECT user_id, COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(is_fraud), 0)
+            FROM transactions
+            GROUP BY user_id
+        ''')
     
     def get_fraud_statistics(self):
         """Get fraud detection statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Total transactions
-        cursor.execute('SELECT COUNT(*) FROM transactions')
-        total_transactions = cursor.fetchone()[0]
-        
-        # Fraud transactions
-        cursor.execute('SELECT COUNT(*) FROM transactions WHERE is_fraud = 1')
-        fraud_transactions = cursor.fetchone()[0]
-        
-        # High risk transactions
-        cursor.execute("SELECT COUNT(*) FROM transactions WHERE risk_level = 'High'")
-        high_risk_transactions = cursor.fetchone()[0]
-        
-        # Average fraud probability
-        cursor.execute('SELECT AVG(fraud_probability) FROM transactions')
-        avg_fraud_prob = cursor.fetchone()[0] or 0
-        
-        # Open alerts
-        cursor.execute("SELECT COUNT(*) FROM fraud_alerts WHERE status = 'open'")
-        open_alerts = cursor.fetchone()[0]
-        
-        conn.close()
+        # One pass over transactions plus the open-alert count, in a single round trip
+        (total_transactions, fraud_transactions, high_risk_transactions,
+         avg_fraud_prob, open_alerts) = self._connect().execute('''
+            SELECT 
+                COUNT(*),
+                COALESCE(SUM(is_fraud = 1), 0),
+                COALESCE(SUM(risk_level = 'High'), 0),
+                COALESCE(AVG(fraud_probability), 0),
+                (SELECT COUNT(*) FROM fraud_alerts WHERE status = 'open')
+            FROM transactions
+        ''').fetchone()
         
         return {
             'total_transactions': total_transactions,
@@ -170,28 +394,21 @@ class FraudDatabase:
     
     def get_fraud_trends(self, days=7):
         """Get fraud trends over the last N days"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
+        return self._fetch_dicts('''
             SELECT 
                 DATE(timestamp) as date,
                 COUNT(*) as total_transactions,
                 SUM(is_fraud) as fraud_transactions,
                 AVG(fraud_probability) as avg_fraud_probability
             FROM transactions 
-            WHERE timestamp >= datetime('now', '-{} days')
+            WHERE DATE(timestamp) >= DATE('now', ?)
             GROUP BY DATE(timestamp)
             ORDER BY date
-        '''.format(days), conn)
-        
-        conn.close()
-        return df
+        ''', (f'-{int(days)} days',))
     
     def get_open_alerts(self):
         """Get all open fraud alerts"""
-        conn = sqlite3.connect(self.db_path)
-        
-        df = pd.read_sql_query('''
+        return self._fetch_dicts('''
             SELECT 
                 fa.id,
                 fa.transaction_id,
@@ -206,10 +423,66 @@ class FraudDatabase:
             JOIN transactions t ON fa.transaction_id = t.transaction_id
             WHERE fa.status = 'open'
             ORDER BY fa.created_at DESC
-        ''', conn)
+        ''')
+    
+    def _fetch_dicts(self, query, params=()):
+        """Run a SELECT and return the rows as a list of dicts"""
+        return list(self._iter_dicts(query, params))
+    
+    def _iter_dicts(self, query, params=()):
+        """Run a SELECT and yield the rows as dicts without materializing the result"""
+        cursor = self._connect().execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+class WriteBehindLogger:
+    """Buffers transaction writes and flushes them in batches on a background thread"""
+    
+    def __init__(self, db, max_batch=100, flush_interval=0.05, max_pending=0):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval  # seconds
+        # With max_pending set, log() blocks once that many writes are waiting (0 = unbounded)
+        self.queue = Queue(maxsize=max_pending)
         
-        conn.close()
-        return df
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+    
+    def log(self, transaction_data, prediction_result, alert=None):
+        """Queue a transaction (and optional alert tuple) for writing"""
+        self.queue.put((transaction_data, prediction_result, alert))
+    
+    def flush(self):
+        """Block until every queued write has been committed"""
+        self.queue.join()
+    
+    def _drain(self):
+        """Wait for a write, then collect more until the batch is full or the interval ends"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._drain()
+            try:
+                self.db.insert_transactions_bulk(
+                    [(transaction_data, prediction_result) for transaction_data, prediction_result, _ in batch],
+                    [alert for _, _, alert in batch if alert]
+                )
+            except Exception as e:
+                print(f"Error flushing transaction writes: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
 
 # Demonstration
 if __name__ == "__main__":
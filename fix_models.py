@@ -8,19 +8,19 @@ db = FraudDatabase()
 
 # Generate synthetic data and train models
 print("Generating synthetic data...")
-df = fraud_detector.generate_synthetic_data(n_samples=5000)
-print(f"Generated {len(df)} synthetic transactions")
+dataset = fraud_detector.generate_synthetic_data(n_samples=5000)
+print(f"Generated {len(dataset)} synthetic transactions")
 
 # Note: We're no longer adding behavioral features
 # print("Adding behavioral features...")
 # df = fraud_detector.add_behavioral_features(df)
 
 print("Training models...")
-results = fraud_detector.train_models(df)
+results = fraud_detector.train_models(dataset)
 
 print("Saving models...")
 fraud_detector.save_models()
 
 print("Done! Models have been trained and saved.")
 print(f"Random Forest Accuracy: {results['rf_accuracy']:.4f}")
-print(f"SVM Accuracy: {results['svm_accuracy']:.4f}")
\ No newline at end of file
+print(f"Gradient Boosting Accuracy: {results['svm_accuracy']:.4f}")
\ No newline at end of file
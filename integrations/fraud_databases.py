@@ -1,21 +1,325 @@
-import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import hashlib
 import hmac
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 import logging
+import os
 import sqlite3
+import time
+import zlib
+import atexit
+from itertools import islice
+import threading
+from queue import Queue, Empty
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from database import TransactionIdFilter
+from config import config
+
+try:
+    import orjson
+except ImportError:  # optional speedup; payloads are encoded with the json module without it
+    orjson = None
+
+# (connect, read) timeouts for fraud API calls, in seconds
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Internal reputation score at or above which MaxMind and Sift are not consulted. The
+# internal score tops out at 0.8 (IP 0.5 + email 0.3 weighting)
+EXTERNAL_SKIP_THRESHOLD = 0.7
+
+# Weights of each source's risk score in combined_risk_score
+EXTERNAL_WEIGHTS = (('maxmind', 0.4), ('sift', 0.3))
+INTERNAL_WEIGHT = 0.3
+
+# HTTP connection pool sizing per integration; size pool_maxsize to the expected concurrent
+# requests per host (FraudDatabaseManager takes both as parameters)
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 50
+
+# Transient failures are retried inside the session, on the pooled connection, with
+# exponential backoff. POST is included: MaxMind scoring has no side effects and Sift
+# events carry an idempotency key. A final failed status is returned, not raised.
+RETRY_POLICY = Retry(
+    total=3,
+    connect=2,
+    read=2,
+    status=2,
+    backoff_factor=0.25,
+    status_forcelist=(429, 502, 503, 504),
+    allowed_methods=frozenset(['GET', 'POST']),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# Seconds a remote fraud score is reused for an identical transaction fingerprint
+MAXMIND_CACHE_TTL = 300
+SIFT_CACHE_TTL = 60
+CACHE_TTL_BOUNDS = (5, 300)
+
+# Seconds analyze_transaction waits for the remote lookups before scoring without them
+ANALYSIS_TIMEOUT = 5
+
+# Internal email fingerprints; MaxMind's API still requires MD5 (see _md5_if_exists)
+_email_hasher = hashlib.blake2b if 'blake2b' in hashlib.algorithms_guaranteed else hashlib.sha256
+
+
+def _email_fingerprints(email: str):
+    """Return the (legacy MD5, BLAKE2b) hashes for an email address"""
+    normalized = email.lower().encode()
+    return hashlib.md5(normalized).hexdigest(), _email_hasher(normalized, digest_size=16).hexdigest()
+
+
+@dataclass(frozen=True, slots=True)
+class NormalizedTxn:
+    """Values analyze_transaction needs more than once, derived from the transaction dict once"""
+    transaction_id: Optional[str]
+    user_id: Optional[str]
+    ip_address: Optional[str]
+    email: Optional[str]  # lower-cased
+    email_hash: Optional[str]  # legacy MD5
+    email_hash_v2: Optional[str]
+    
+    @classmethod
+    def from_dict(cls, transaction_data: Dict) -> 'NormalizedTxn':
+        email = transaction_data.get('email')
+        email_hash, email_hash_v2 = _email_fingerprints(email) if email else (None, None)
+        return cls(
+            transaction_id=transaction_data.get('transaction_id'),
+            user_id=transaction_data.get('user_id'),
+            ip_address=transaction_data.get('ip_address'),
+            email=email.lower() if email else email,
+            email_hash=email_hash,
+            email_hash_v2=email_hash_v2,
+        )
+
+
+# Background writer batching for fraud intelligence and reputation rows
+WRITE_BATCH_SIZE = 200
+WRITE_FLUSH_INTERVAL = 0.1  # seconds
+RAW_RESPONSE_ZLIB_LEVEL = 3  # fast; JSON responses still shrink several-fold
+BULK_CHUNK_SIZE = 10_000  # rows per queued chunk for bulk reputation imports
+# Seconds between scans for reputation rows written by other processes, e.g. import scripts
+REPUTATION_FILTER_REFRESH = 5.0
+
+INSERT_INTELLIGENCE_SQL = '''
+    INSERT OR REPLACE INTO fraud_intelligence 
+    (transaction_id, source, risk_score, risk_factors, raw_response_zlib)
+    VALUES (?, ?, ?, ?, ?)
+'''
+INSERT_CACHE_SQL = '''
+    INSERT OR REPLACE INTO fraud_response_cache (cache_key, source, response_json, expires_at)
+    VALUES (?, ?, ?, ?)
+'''
+SWEEP_CACHE_SQL = 'DELETE FROM fraud_response_cache WHERE expires_at <= ?'
+SELECT_CACHE_SQL = 'SELECT response_json FROM fraud_response_cache WHERE cache_key = ? AND expires_at > ?'
+# Both reputation lookups in one round-trip; each branch is served from its covering index
+SELECT_REPUTATION_SQL = '''
+    SELECT 'ip', risk_score, is_proxy, is_vpn FROM ip_reputation WHERE ip_address = ?
+    UNION ALL
+    SELECT 'email', risk_score, is_disposable, NULL FROM email_reputation
+    WHERE email_hash_v2 = ? OR email_hash = ?
+'''
+UPSERT_IP_REPUTATION_SQL = '''
+    INSERT OR REPLACE INTO ip_reputation 
+    (ip_address, risk_score, country, is_proxy, is_vpn, last_updated)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+UPSERT_EMAIL_REPUTATION_SQL = '''
+    INSERT OR REPLACE INTO email_reputation 
+    (email_hash, email_hash_v2, risk_score, is_disposable, domain_age_days, last_updated)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+
+# Transaction fields that determine a MaxMind score for cache lookups
+MAXMIND_FINGERPRINT_FIELDS = ('user_id', 'ip_address', 'email', 'amount', 'currency', 'card_bin')
+
+# MaxMind request layout: (section.field, transaction key, default)
+_MAXMIND_FIELDS = (
+    ('device.ip_address', 'ip_address', '127.0.0.1'),
+    ('device.user_agent', 'user_agent', ''),
+    ('device.accept_language', 'accept_language', 'en-US'),
+    ('event.transaction_id', 'transaction_id', None),
+    ('event.shop_id', 'shop_id', 'default'),
+    ('account.user_id', 'user_id', None),
+    ('email.address', 'email', None),
+    ('billing.first_name', 'billing_first_name', None),
+    ('billing.last_name', 'billing_last_name', None),
+    ('billing.company', 'billing_company', None),
+    ('billing.address', 'billing_address', None),
+    ('billing.address_2', 'billing_address_2', None),
+    ('billing.city', 'billing_city', None),
+    ('billing.region', 'billing_region', None),
+    ('billing.country', 'billing_country', None),
+    ('billing.postal', 'billing_postal', None),
+    ('billing.phone_number', 'billing_phone', None),
+    ('payment.processor', 'payment_processor', 'stripe'),
+    ('payment.was_authorized', 'was_authorized', True),
+    ('payment.decline_code', 'decline_code', None),
+    ('order.amount', 'amount', 0),
+    ('order.currency', 'currency', 'USD'),
+    ('order.discount_code', 'discount_code', None),
+    ('order.affiliate_id', 'affiliate_id', None),
+    ('order.subaffiliate_id', 'subaffiliate_id', None),
+    ('order.referrer_uri', 'referrer_uri', None),
+)
+
+# Fields computed from the transaction rather than copied: (section.field, expression over d)
+_MAXMIND_DERIVED_FIELDS = (
+    ('event.time', "d['timestamp'] if 'timestamp' in d else _now()"),
+    ('event.type', "'purchase'"),
+    ('account.username_md5', "_md5_if_exists(d.get('username'))"),
+    ('email.domain', "_email_domain(d.get('email'))"),
+)
+
+def _md5_if_exists(value: str) -> Optional[str]:
+    """Hash a value with MD5 if it exists"""
+    if value:
+        return hashlib.md5(value.encode()).hexdigest()
+    return None
+
+_now_cache = (None, None)  # (epoch second, formatted timestamp)
+
+def _utc_now_iso() -> str:
+    """Current UTC time in RFC 3339 form, formatted at most once per second"""
+    global _now_cache
+    second = time.time_ns() // 1_000_000_000
+    cached_second, formatted = _now_cache
+    if second != cached_second:
+        formatted = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(second))
+        _now_cache = (second, formatted)
+    return formatted
+
+def _email_domain(email: str) -> Optional[str]:
+    return email.split('@')[-1] if email else None
+
+def _build_maxmind_request_builder():
+    """Generate a function assembling a MaxMind request from a transaction dict"""
+    # The layout is fixed, so the field tables compile once into straight-line code that
+    # skips None fields and omits empty sections
+    sections = {}
+    for path, key, default in _MAXMIND_FIELDS:
+        section, field = path.split('.')
+        source = f'd.get({key!r})' if default is None else f'd.get({key!r}, {default!r})'
+        sections.setdefault(section, []).append((field, source))
+    for path, source in _MAXMIND_DERIVED_FIELDS:
+        section, field = path.split('.')
+        sections.setdefault(section, []).append((field, source))
+    
+    lines = ['def prepare_maxmind_request(d):', '    request = {}']
+    for section, fields in sections.items():
+        lines.append('    s = {}')
+        for field, source in fields:
+            lines.append(f'    v = {source}')
+            lines.append(f'    if v is not None: s[{field!r}] = v')
+        lines.append(f'    if s: request[{section!r}] = s')
+    lines.append('    return request')
+    
+    namespace = {
+        '_now': _utc_now_iso,
+        '_md5_if_exists': _md5_if_exists,
+        '_email_domain': _email_domain,
+    }
+    exec('\n'.join(lines) + '\n', namespace)
+    return namespace['prepare_maxmind_request']
+
+_prepare_maxmind_fields = _build_maxmind_request_builder()
+
+def _dumps_bytes(obj) -> bytes:
+    """Serialize a request body or stored result to UTF-8 JSON"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. non-string keys, which the json module still accepts
+    return json.dumps(obj).encode()
+
+def _dumps(obj) -> str:
+    return _dumps_bytes(obj).decode()
+
+def _loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def decode_raw_response(blob: bytes) -> Dict:
+    """Decode a fraud_intelligence.raw_response_zlib value back into the stored result"""
+    return _loads(zlib.decompress(blob))
+
+def _build_session(pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE) -> requests.Session:
+    """Create a keep-alive session so repeat API calls reuse pooled TLS connections"""
+    # pool_maxsize caps idle connections per host; requests beyond it open extra
+    # connections rather than queueing
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=False,
+        max_retries=RETRY_POLICY
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class _SingleFlight:
+    """Collapse concurrent calls for the same key onto one in-flight call"""
+    # The first caller runs the function; later ones wait for and share its result or exception
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, fn, *args):
+        """Return (result, shared), where shared is True if another caller's call was reused"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class _SessionOwner:
+    """Gives an integration a pooled HTTP session that is released by close() or a with block"""
+    
+    def close(self):
+        self._session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-class MaxMindIntegration:
+class MaxMindIntegration(_SessionOwner):
     """Integration with MaxMind minFraud service for fraud detection"""
     
-    def __init__(self, account_id: str = None, license_key: str = None):
-        self.account_id = account_id or os.getenv('MAXMIND_ACCOUNT_ID')
-        self.license_key = license_key or os.getenv('MAXMIND_LICENSE_KEY')
+    def __init__(self, account_id: str = None, license_key: str = None,
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        self.account_id = account_id or config.MAXMIND_ACCOUNT_ID
+        self.license_key = license_key or config.MAXMIND_LICENSE_KEY
         self.base_url = 'https://minfraud.maxmind.com/minfraud/v2.0'
         self.logger = logging.getLogger(__name__)
+        
+        self._session = _build_session(pool_connections, pool_maxsize)
+        self._session.auth = (self.account_id, self.license_key)
+        self._session.headers.update({'Content-Type': 'application/json'})
     
     def score_transaction(self, transaction_data: Dict) -> Dict:
         """Get fraud score from MaxMind minFraud"""
@@ -25,15 +329,10 @@ class MaxMindIntegration:
             # Prepare request data in MaxMind format
             request_data = self._prepare_maxmind_request(transaction_data)
             
-            response = requests.post(
-                url,
-                json=request_data,
-                auth=(self.account_id, self.license_key),
-                headers={'Content-Type': 'application/json'}
-            )
+            response = self._session.post(url, data=_dumps_bytes(request_data), timeout=REQUEST_TIMEOUT)
             
             if response.status_code == 200:
-                result = response.json()
+                result = _loads(response.content)
                 return self._process_maxmind_response(result)
             else:
                 self.logger.error(f"MaxMind API error: {response.text}")
@@ -45,67 +344,7 @@ class MaxMindIntegration:
     
     def _prepare_maxmind_request(self, transaction_data: Dict) -> Dict:
         """Convert transaction data to MaxMind format"""
-        request_data = {
-            'device': {
-                'ip_address': transaction_data.get('ip_address', '127.0.0.1'),
-                'user_agent': transaction_data.get('user_agent', ''),
-                'accept_language': transaction_data.get('accept_language', 'en-US')
-            },
-            'event': {
-                'transaction_id': transaction_data.get('transaction_id'),
-                'shop_id': transaction_data.get('shop_id', 'default'),
-                'time': transaction_data.get('timestamp', datetime.now().isoformat()),
-                'type': 'purchase'
-            },
-            'account': {
-                'user_id': transaction_data.get('user_id'),
-                'username_md5': self._hash_if_exists(transaction_data.get('username'))
-            },
-            'email': {
-                'address': transaction_data.get('email'),
-                'domain': transaction_data.get('email', '').split('@')[-1] if transaction_data.get('email') else None
-            },
-            'billing': {
-                'first_name': transaction_data.get('billing_first_name'),
-                'last_name': transaction_data.get('billing_last_name'),
-                'company': transaction_data.get('billing_company'),
-                'address': transaction_data.get('billing_address'),
-                'address_2': transaction_data.get('billing_address_2'),
-                'city': transaction_data.get('billing_city'),
-                'region': transaction_data.get('billing_region'),
-                'country': transaction_data.get('billing_country'),
-                'postal': transaction_data.get('billing_postal'),
-                'phone_number': transaction_data.get('billing_phone')
-            },
-            'payment': {
-                'processor': transaction_data.get('payment_processor', 'stripe'),
-                'was_authorized': transaction_data.get('was_authorized', True),
-                'decline_code': transaction_data.get('decline_code')
-            },
-            'order': {
-                'amount': transaction_data.get('amount', 0),
-                'currency': transaction_data.get('currency', 'USD'),
-                'discount_code': transaction_data.get('discount_code'),
-                'affiliate_id': transaction_data.get('affiliate_id'),
-                'subaffiliate_id': transaction_data.get('subaffiliate_id'),
-                'referrer_uri': transaction_data.get('referrer_uri')
-            }
-        }
-        
-        # Remove None values
-        return self._remove_none_values(request_data)
-    
-    def _hash_if_exists(self, value: str) -> Optional[str]:
-        """Hash a value with MD5 if it exists"""
-        if value:
-            return hashlib.md5(value.encode()).hexdigest()
-        return None
-    
-    def _remove_none_values(self, data: Dict) -> Dict:
-        """Recursively remove None values from dictionary"""
-        if isinstance(data, dict):
-            return {k: self._remove_none_values(v) for k, v in data.items() if v is not None}
-        return data
+        return _prepare_maxmind_fields(transaction_data)
     
     def _process_maxmind_response(self, response: Dict) -> Dict:
         """Process MaxMind response into our format"""
@@ -134,13 +373,17 @@ class MaxMindIntegration:
             'warnings': response.get('warnings', [])
         }
 
-class SiftIntegration:
+class SiftIntegration(_SessionOwner):
     """Integration with Sift fraud detection service"""
     
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or os.getenv('SIFT_API_KEY')
+    def __init__(self, api_key: str = None,
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        self.api_key = api_key or config.SIFT_API_KEY
         self.base_url = 'https://api.sift.com/v205'
         self.logger = logging.getLogger(__name__)
+        
+        self._session = _build_session(pool_connections, pool_maxsize)
+        self._session.headers.update({'Content-Type': 'application/json'})
     
     def send_transaction_event(self, transaction_data: Dict) -> Dict:
         """Send transaction event to Sift"""
@@ -150,15 +393,20 @@ class SiftIntegration:
             # Prepare Sift event data
             event_data = self._prepare_sift_event(transaction_data)
             
-            response = requests.post(
+            # Lets Sift discard a duplicate if the session retries this POST
+            transaction_id = transaction_data.get('transaction_id')
+            headers = {'Idempotency-Key': f'sift-event-{transaction_id}'} if transaction_id else None
+            
+            response = self._session.post(
                 url,
-                json=event_data,
+                data=_dumps_bytes(event_data),
                 params={'api_key': self.api_key},
-                headers={'Content-Type': 'application/json'}
+                headers=headers,
+                timeout=REQUEST_TIMEOUT
             )
             
             if response.status_code == 200:
-                return response.json()
+                return _loads(response.content)
             else:
                 self.logger.error(f"Sift API error: {response.text}")
                 return {'error': 'API request failed'}
@@ -172,13 +420,14 @@ class SiftIntegration:
         try:
             url = f"{self.base_url}/score/{user_id}"
             
-            response = requests.get(
+            response = self._session.get(
                 url,
-                params={'api_key': self.api_key}
+                params={'api_key': self.api_key},
+                timeout=REQUEST_TIMEOUT
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = _loads(response.content)
                 return self._process_sift_score(result)
             else:
                 self.logger.error(f"Sift score API error: {response.text}")
@@ -198,7 +447,7 @@ class SiftIntegration:
             '$user_email': transaction_data.get('email'),
             '$amount': int(transaction_data.get('amount', 0) * 1000000),  # Convert to micros
             '$currency_code': transaction_data.get('currency', 'USD'),
-            '$time': int(datetime.now().timestamp() * 1000),  # Convert to milliseconds
+            '$time': time.time_ns() // 1_000_000,  # milliseconds
             '$transaction_type': '$sale',
             '$transaction_status': '$success',
             '$ip': transaction_data.get('ip_address'),
@@ -238,21 +487,190 @@ class SiftIntegration:
             'latest_decisions': response.get('latest_decisions', {})
         }
 
+@lru_cache(maxsize=None)
+def get_maxmind_integration(pool_connections: int = POOL_CONNECTIONS,
+                            pool_maxsize: int = POOL_MAXSIZE) -> MaxMindIntegration:
+    """Return the process-wide MaxMind integration for this pool size, sharing its session"""
+    return MaxMindIntegration(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+@lru_cache(maxsize=None)
+def get_sift_integration(pool_connections: int = POOL_CONNECTIONS,
+                         pool_maxsize: int = POOL_MAXSIZE) -> SiftIntegration:
+    """Return the process-wide Sift integration for this pool size, sharing its session"""
+    return SiftIntegration(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+class _ReputationKeys:
+    """Bloom filter over every IP and email hash with a reputation row, shared per database file"""
+    # Rows written by other processes are picked up by rescanning ids above the last one seen;
+    # reputation upserts are INSERT OR REPLACE on AUTOINCREMENT tables, so ids only grow
+    
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        # Only used under the lock, so any thread may run the scan
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._last_ids = {'ip': 0, 'email': 0}
+        self._count = 0
+        self._filter = TransactionIdFilter(capacity=100_000, error_rate=0.01)
+        self._next_refresh = 0.0
+        self.refresh()
+    
+    def __contains__(self, key) -> bool:
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        return key in self._filter
+    
+    def add(self, key):
+        with self._lock:
+            self._filter.add(key)
+    
+    def refresh(self):
+        """Add the keys of reputation rows committed since the last scan"""
+        with self._lock:
+            if time.monotonic() < self._next_refresh:
+                return  # another thread just scanned
+            keys = self._scan()
+            if self._count + len(keys) > self._filter.capacity:
+                # Rebuild larger so the false-positive rate stays near its target
+                self._last_ids = {'ip': 0, 'email': 0}
+                keys = self._scan()
+                self._filter = TransactionIdFilter(capacity=max(100_000, 2 * len(keys)), error_rate=0.01)
+                self._count = 0
+            for key in keys:
+                self._filter.add(key)
+            self._count += len(keys)
+            self._next_refresh = time.monotonic() + REPUTATION_FILTER_REFRESH
+    
+    def _scan(self) -> List[str]:
+        keys = []
+        for row_id, ip_address in self._conn.execute(
+                'SELECT id, ip_address FROM ip_reputation WHERE id > ?', (self._last_ids['ip'],)):
+            keys.append(ip_address)
+            self._last_ids['ip'] = max(self._last_ids['ip'], row_id)
+        for row_id, email_hash, email_hash_v2 in self._conn.execute(
+                'SELECT id, email_hash, email_hash_v2 FROM email_reputation WHERE id > ?',
+                (self._last_ids['email'],)):
+            keys.append(email_hash)
+            if email_hash_v2:
+                keys.append(email_hash_v2)
+            self._last_ids['email'] = max(self._last_ids['email'], row_id)
+        return keys
+
+@lru_cache(maxsize=None)
+def get_reputation_keys(db_path: str) -> _ReputationKeys:
+    """Return the process-wide reputation key filter for this database file"""
+    return _ReputationKeys(db_path)
+
 class FraudDatabaseManager:
     """Manages multiple fraud database integrations"""
     
-    def __init__(self, db_path: str = 'fraud_intelligence.db'):
+    def __init__(self, db_path: str = 'fraud_intelligence.db',
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE,
+                 external_skip_threshold: float = EXTERNAL_SKIP_THRESHOLD):
         self.db_path = db_path
-        self.maxmind = MaxMindIntegration()
-        self.sift = SiftIntegration()
+        self.external_skip_threshold = external_skip_threshold
+        self._local = threading.local()
+        # Shared with every other manager in the process, so their connection pools are too
+        self.maxmind = get_maxmind_integration(pool_connections, pool_maxsize)
+        self.sift = get_sift_integration(pool_connections, pool_maxsize)
         self.init_database()
+        self._reputation_keys = get_reputation_keys(os.path.abspath(db_path))
         self.logger = logging.getLogger(__name__)
+        self.cache_stats = Counter()  # response cache hits/misses/coalesced, skipped external lookups
+        self._inflight = _SingleFlight()
+        # Writes are queued and committed in batches by a single background thread
+        self._write_queue = Queue(maxsize=10000)
+        self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer_thread.start()
+        atexit.register(self.flush)
+        
+        # Shared by concurrent analyses (see analyze_transactions_batch), so sized for several at once
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='fraud')
+    
+    def _connect(self):
+        """Return this thread's long-lived read connection, opening it on first use"""
+        # Reused so its page cache and prepared statements stay warm
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+        return conn
+    
+    def _open_connection(self):
+        """Open a connection tuned for the WAL-mode intelligence database"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')  # serve reads from the OS page cache
+        conn.execute('PRAGMA cache_size=-65536')  # 64 MB page cache
+        return conn
+    
+    def flush(self):
+        """Block until every queued write has been committed"""
+        self._write_queue.join()
+    
+    def _queue_write(self, sql: str, params: tuple):
+        """Queue one statement for the background writer"""
+        self._write_queue.put((sql, [params]))
+    
+    def _queue_write_many(self, sql: str, rows: list):
+        """Queue a chunk of parameter rows for one statement"""
+        if rows:
+            self._write_queue.put((sql, rows))
+    
+    def _writer_loop(self):
+        """Commit queued writes in batches, one executemany per statement"""
+        # The only writing connection, so writes need no lock; WAL readers never block on it
+        conn = self._open_connection()
+        
+        while True:
+            batch = [self._write_queue.get()]
+            deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(
+                        self._write_queue.get(timeout=remaining) if remaining > 0 else self._write_queue.get_nowait()
+                    )
+                except Empty:
+                    break
+            
+            # Group by statement; rows for the same table keep their queue order
+            grouped = {}
+            for sql, rows in batch:
+                grouped.setdefault(sql, []).extend(rows)
+            
+            try:
+                with conn:
+                    for sql, rows in grouped.items():
+                        conn.executemany(sql, rows)
+            except sqlite3.Error as e:
+                self.logger.error(f"Error writing fraud intelligence batch: {e}")
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+    
+    def close(self):
+        """Release the lookup threads and commit pending writes"""
+        # The integrations are process-wide, so their pooled connections stay open
+        # for other managers
+        self._executor.shutdown(wait=True)
+        self.flush()
+        self._connect().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def init_database(self):
         """Initialize fraud intelligence database"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # WAL lets lookups read while the background writer commits
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Create fraud intelligence table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS fraud_intelligence (
@@ -262,10 +680,29 @@ class FraudDatabaseManager:
                 risk_score REAL,
                 risk_factors TEXT,
                 raw_response TEXT,
+                raw_response_zlib BLOB,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # Results are stored zlib-compressed; raw_response only holds rows written before that
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(fraud_intelligence)')}
+        if 'raw_response_zlib' not in columns:
+            cursor.execute('ALTER TABLE fraud_intelligence ADD COLUMN raw_response_zlib BLOB')
+        
+        # Cached remote scores, keyed by source and a hash of the fields that determine them
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fraud_response_cache (
+                cache_key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                response_json TEXT NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON fraud_response_cache(expires_at)'
+        )
+        
         # Create IP reputation table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ip_reputation (
@@ -284,6 +721,7 @@ class FraudDatabaseManager:
             CREATE TABLE IF NOT EXISTS email_reputation (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 email_hash TEXT UNIQUE NOT NULL,
+                email_hash_v2 TEXT,
                 risk_score REAL,
                 is_disposable BOOLEAN,
                 domain_age_days INTEGER,
@@ -291,6 +729,26 @@ class FraudDatabaseManager:
             )
         ''')
         
+        # Covering indexes for the reputation lookups
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_ip_rep_cover ON ip_reputation(ip_address, risk_score, is_proxy, is_vpn)'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_email_rep_cover ON email_reputation(email_hash, risk_score, is_disposable)'
+        )
+        
+        # Databases created before email_hash_v2 existed get the column added; both hashes are
+        # written until every row carries a v2 hash
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(email_reputation)')}
+        if 'email_hash_v2' not in columns:
+            cursor.execute('ALTER TABLE email_reputation ADD COLUMN email_hash_v2 TEXT')
+        cursor.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_email_rep_v2 ON email_reputation(email_hash_v2)'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_email_rep_v2_cover ON email_reputation(email_hash_v2, risk_score, is_disposable)'
+        )
+        
         conn.commit()
         conn.close()
     
@@ -301,46 +759,81 @@ class FraudDatabaseManager:
             'risk_factors': [],
             'source_results': {}
         }
+        txn = NormalizedTxn.from_dict(transaction_data)
         
-        # MaxMind analysis
-        if self.maxmind.account_id and self.maxmind.license_key:
-            maxmind_result = self.maxmind.score_transaction(transaction_data)
-            if 'error' not in maxmind_result:
-                results['source_results']['maxmind'] = maxmind_result
-                results['combined_risk_score'] += maxmind_result.get('risk_score', 0) * 0.4
-                results['risk_factors'].extend(maxmind_result.get('risk_factors', []))
-                
-                # Store in database
-                self._store_fraud_intelligence(
-                    transaction_data.get('transaction_id'),
-                    'maxmind',
-                    maxmind_result
-                )
+        # Internal reputation is a local lookup, so it runs first; a known-bad IP or
+        # email is conclusive without paying for MaxMind and Sift
+        internal_result = self._check_internal_reputation(txn)
+        scored_sources = self._external_score_sources(txn)
+        if internal_result['risk_score'] >= self.external_skip_threshold:
+            self.cache_stats['external_skipped'] += 1
+            # Only the score lookups are skipped; Sift still gets the transaction event,
+            # sent in the background since nothing here waits on it
+            if self.sift.api_key:
+                self._executor.submit(self.sift.send_transaction_event, transaction_data)
+            # Each skipped source is weighted as if it had returned the internal score, so
+            # crossing the threshold does not jump the combined score when the external
+            # scores would have agreed; with none configured this is the usual weighting
+            weight = INTERNAL_WEIGHT + sum(
+                source_weight for source, source_weight in EXTERNAL_WEIGHTS if source in scored_sources
+            )
+            results['source_results']['internal'] = internal_result
+            results['combined_risk_score'] = min(internal_result['risk_score'] * weight, 1.0)
+            results['risk_factors'] = list(internal_result['risk_factors'])
+            return results
+        
+        # Start the remote lookups concurrently; each is one HTTPS round trip
+        futures = {}
+        if 'maxmind' in scored_sources:
+            fingerprint = {field: transaction_data.get(field) for field in MAXMIND_FINGERPRINT_FIELDS}
+            fingerprint['email'] = txn.email
+            futures['maxmind'] = self._executor.submit(
+                self._cached_call, 'maxmind', fingerprint, MAXMIND_CACHE_TTL,
+                self.maxmind.score_transaction, transaction_data
+            )
         
-        # Sift analysis
         if self.sift.api_key:
             # Send transaction event
-            sift_event_result = self.sift.send_transaction_event(transaction_data)
+            futures['sift_event'] = self._executor.submit(self.sift.send_transaction_event, transaction_data)
             
             # Get user score
-            if transaction_data.get('user_id'):
-                sift_score_result = self.sift.get_user_score(transaction_data['user_id'])
-                if 'error' not in sift_score_result:
-                    results['source_results']['sift'] = sift_score_result
-                    results['combined_risk_score'] += sift_score_result.get('risk_score', 0) * 0.3
-                    results['risk_factors'].extend(sift_score_result.get('risk_factors', []))
-                    
-                    # Store in database
-                    self._store_fraud_intelligence(
-                        transaction_data.get('transaction_id'),
-                        'sift',
-                        sift_score_result
-                    )
+            if 'sift' in scored_sources:
+                futures['sift'] = self._executor.submit(
+                    self._cached_call, 'sift', {'user_id': txn.user_id}, SIFT_CACHE_TTL,
+                    self.sift.get_user_score, txn.user_id
+                )
+        
+        done, _ = wait(futures.values(), timeout=ANALYSIS_TIMEOUT)
+        
+        # MaxMind and Sift score results, in their original weighting order; a source that
+        # failed or timed out is treated as unavailable
+        for source, weight in EXTERNAL_WEIGHTS:
+            future = futures.get(source)
+            if future is None:
+                continue
+            if future not in done:
+                self.logger.warning(f"{source} lookup timed out for {txn.transaction_id}")
+                continue
+            try:
+                source_result = future.result()
+            except Exception as e:
+                self.logger.error(f"Error in {source} lookup: {e}")
+                continue
+            
+            if 'error' not in source_result:
+                results['source_results'][source] = source_result
+                results['combined_risk_score'] += source_result.get('risk_score', 0) * weight
+                results['risk_factors'].extend(source_result.get('risk_factors', []))
+                
+                # Store in database
+                self._store_fraud_intelligence(
+                    txn.transaction_id,
+                    source,
+                    source_result
+                )
         
-        # Internal reputation checks
-        internal_result = self._check_internal_reputation(transaction_data)
         results['source_results']['internal'] = internal_result
-        results['combined_risk_score'] += internal_result.get('risk_score', 0) * 0.3
+        results['combined_risk_score'] += internal_result.get('risk_score', 0) * INTERNAL_WEIGHT
         results['risk_factors'].extend(internal_result.get('risk_factors', []))
         
         # Normalize combined score
@@ -351,103 +844,133 @@ class FraudDatabaseManager:
         
         return results
     
-    def _check_internal_reputation(self, transaction_data: Dict) -> Dict:
+    def _external_score_sources(self, txn: NormalizedTxn) -> set:
+        """Return the external sources that would contribute a score for this transaction"""
+        sources = set()
+        if self.maxmind.account_id and self.maxmind.license_key:
+            sources.add('maxmind')
+        if self.sift.api_key and txn.user_id:
+            sources.add('sift')
+        return sources
+    
+    def analyze_transactions_batch(self, transactions: List[Dict], max_workers: int = 8) -> List[Dict]:
+        """Analyze many transactions, overlapping the external API round-trips"""
+        if not transactions:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(transactions))) as executor:
+            return list(executor.map(self.analyze_transaction, transactions))
+    
+    def _cached_call(self, source: str, fingerprint: Dict, ttl: int, fetch, *args) -> Dict:
+        """Return a cached remote result for this fingerprint, or fetch and cache it"""
+        # Errors are never cached, and concurrent misses for one key share a single remote call
+        canonical = json.dumps(fingerprint, sort_keys=True, separators=(',', ':'), default=str)
+        cache_key = source + ':' + hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+        now = int(time.time())
+        
+        row = self._connect().execute(SELECT_CACHE_SQL, (cache_key, now)).fetchone()
+        
+        if row:
+            self.cache_stats['hits'] += 1
+            return _loads(row[0])
+        
+        result, shared = self._inflight.do(cache_key, self._fetch_and_cache, cache_key, source, ttl, now, fetch, args)
+        self.cache_stats['coalesced' if shared else 'misses'] += 1
+        return result
+    
+    def _fetch_and_cache(self, cache_key: str, source: str, ttl: int, now: int, fetch, args: tuple) -> Dict:
+        result = fetch(*args)
+        if 'error' not in result:
+            ttl = min(max(ttl, CACHE_TTL_BOUNDS[0]), CACHE_TTL_BOUNDS[1])
+            self._queue_write(INSERT_CACHE_SQL, (cache_key, source, _dumps(result), now + ttl))
+            self._queue_write(SWEEP_CACHE_SQL, (now,))
+        return result
+    
+    def _check_internal_reputation(self, txn: NormalizedTxn) -> Dict:
         """Check internal reputation databases"""
         risk_score = 0.0
         risk_factors = []
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        ip_address = txn.ip_address
+        if ip_address and ip_address not in self._reputation_keys:
+            ip_address = None
         
-        # Check IP reputation
-        ip_address = transaction_data.get('ip_address')
-        if ip_address:
-            cursor.execute(
-                'SELECT risk_score, is_proxy, is_vpn FROM ip_reputation WHERE ip_address = ?',
-                (ip_address,)
-            )
-            ip_result = cursor.fetchone()
-            if ip_result:
-                ip_risk, is_proxy, is_vpn = ip_result
-                risk_score += ip_risk * 0.5
-                if is_proxy:
+        email_hash, email_hash_v2 = txn.email_hash, txn.email_hash_v2
+        if email_hash and email_hash not in self._reputation_keys and email_hash_v2 not in self._reputation_keys:
+            email_hash = email_hash_v2 = None
+        
+        # Neither key can have a reputation row
+        if not ip_address and not email_hash:
+            return {'risk_score': 0.0, 'risk_factors': []}
+        
+        rows = self._connect().execute(
+            SELECT_REPUTATION_SQL, (ip_address, email_hash_v2, email_hash)
+        ).fetchall()
+        
+        for kind, reputation_risk, flag_a, flag_b in rows:
+            if kind == 'ip':
+                # Check IP reputation
+                risk_score += reputation_risk * 0.5
+                if flag_a:
                     risk_factors.append('proxy_ip')
-                if is_vpn:
+                if flag_b:
                     risk_factors.append('vpn_ip')
-        
-        # Check email reputation
-        email = transaction_data.get('email')
-        if email:
-            email_hash = hashlib.md5(email.lower().encode()).hexdigest()
-            cursor.execute(
-                'SELECT risk_score, is_disposable FROM email_reputation WHERE email_hash = ?',
-                (email_hash,)
-            )
-            email_result = cursor.fetchone()
-            if email_result:
-                email_risk, is_disposable = email_result
-                risk_score += email_risk * 0.3
-                if is_disposable:
+            else:
+                # Check email reputation
+                risk_score += reputation_risk * 0.3
+                if flag_a:
                     risk_factors.append('disposable_email')
         
-        conn.close()
-        
         return {
             'risk_score': min(risk_score, 1.0),
             'risk_factors': risk_factors
         }
     
     def _store_fraud_intelligence(self, transaction_id: str, source: str, result: Dict):
-        """Store fraud intelligence results in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO fraud_intelligence 
-            (transaction_id, source, risk_score, risk_factors, raw_response)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        """Queue fraud intelligence results for the database"""
+        self._queue_write(INSERT_INTELLIGENCE_SQL, (
             transaction_id,
             source,
             result.get('risk_score'),
-            json.dumps(result.get('risk_factors', [])),
-            json.dumps(result)
+            _dumps(result.get('risk_factors', [])),
+            zlib.compress(_dumps_bytes(result), RAW_RESPONSE_ZLIB_LEVEL)
         ))
-        
-        conn.commit()
-        conn.close()
     
     def update_ip_reputation(self, ip_address: str, risk_score: float, 
                            country: str = None, is_proxy: bool = False, is_vpn: bool = False):
-        """Update IP reputation data"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO ip_reputation 
-            (ip_address, risk_score, country, is_proxy, is_vpn, last_updated)
-            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (ip_address, risk_score, country, is_proxy, is_vpn))
-        
-        conn.commit()
-        conn.close()
+        """Update IP reputation data (applied by the background writer; flush() waits for it)"""
+        self.update_ip_reputations_bulk([(ip_address, risk_score, country, is_proxy, is_vpn)])
     
     def update_email_reputation(self, email: str, risk_score: float, 
                               is_disposable: bool = False, domain_age_days: int = None):
-        """Update email reputation data"""
-        email_hash = hashlib.md5(email.lower().encode()).hexdigest()
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO email_reputation 
-            (email_hash, risk_score, is_disposable, domain_age_days, last_updated)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (email_hash, risk_score, is_disposable, domain_age_days))
-        
-        conn.commit()
-        conn.close()
+        """Update email reputation data (applied by the background writer; flush() waits for it)"""
+        self.update_email_reputations_bulk([(email, risk_score, is_disposable, domain_age_days)])
+    
+    def update_ip_reputations_bulk(self, rows: Iterable[Tuple[str, float, str, bool, bool]]):
+        """Import many (ip_address, risk_score, country, is_proxy, is_vpn) rows, e.g. a threat feed"""
+        # Queued in chunks, each written with one executemany
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, BULK_CHUNK_SIZE))
+            if not chunk:
+                break
+            for row in chunk:
+                self._reputation_keys.add(row[0])
+            self._queue_write_many(UPSERT_IP_REPUTATION_SQL, chunk)
+    
+    def update_email_reputations_bulk(self, rows: Iterable[Tuple[str, float, bool, Optional[int]]]):
+        """Import many (email, risk_score, is_disposable, domain_age_days) rows"""
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, BULK_CHUNK_SIZE))
+            if not chunk:
+                break
+            params = []
+            for email, risk_score, is_disposable, domain_age_days in chunk:
+                email_hash, email_hash_v2 = _email_fingerprints(email)
+                self._reputation_keys.add(email_hash)
+                self._reputation_keys.add(email_hash_v2)
+                params.append((email_hash, email_hash_v2, risk_score, is_disposable, domain_age_days))
+            self._queue_write_many(UPSERT_EMAIL_REPUTATION_SQL, params)
 
 # Example usage
 if __name__ == "__main__":
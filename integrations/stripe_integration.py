@@ -1,35 +1,121 @@
 import stripe
 import os
-from datetime import datetime, timedelta
+import json
+import hmac
+import hashlib
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+import time
+import threading
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, List, Optional
 import logging
 
+# (connect, read) seconds for PayPal REST calls
+PAYPAL_TIMEOUT = (3.05, 10)
+# Refresh the OAuth token this many seconds before PayPal says it expires
+TOKEN_EXPIRY_MARGIN = 60
+# Stripe allows 25 requests per second in test mode (100 live); staying under the
+# stricter limit keeps backfills from tripping 429s and the SDK's retry backoff
+STRIPE_REQUESTS_PER_SECOND = 25
+# Webhook bodies are read and HMAC'd in chunks of this many bytes
+WEBHOOK_READ_CHUNK = 64 * 1024
+
+class _TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now and sleep off any deficit outside the lock,
+            # so concurrent callers queue up one refill interval apart
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+class _RateLimitedRequestsClient(stripe.RequestsClient):
+    """Stripe HTTP client that takes a token before every request, SDK retries included"""
+    
+    def __init__(self, bucket: _TokenBucket, **kwargs):
+        super().__init__(**kwargs)
+        self._bucket = bucket
+    
+    def request(self, method, url, headers, post_data=None):
+        self._bucket.acquire()
+        return super().request(method, url, headers, post_data)
+
+_stripe_rate_limiter = _TokenBucket(STRIPE_REQUESTS_PER_SECOND)
+
+def _failed_3ds(payment_method: Dict) -> bool:
+    three_d_secure = payment_method.get('three_d_secure')
+    # A StripeObject, which has no .get() on current SDKs
+    return bool(three_d_secure) and 'result' in three_d_secure and three_d_secure['result'] == 'failed'
+
+# Risk rules as (predicate, weight, factor), evaluated in order. Stripe predicates take
+# (amount_usd, account_age_days, payment_method, stripe_risk_level), with account_age_days
+# None when the customer's creation time is unknown; the batch scorer builds one mask per rule.
+STRIPE_RULES = (
+    (lambda amount, age, pm, level: amount > 1000, 0.2, 'high_amount'),
+    (lambda amount, age, pm, level: age is not None and age < 7, 0.3, 'new_customer'),
+    (lambda amount, age, pm, level: bool(pm.get('country')) and pm['country'] != 'US', 0.1, 'international_card'),
+    (lambda amount, age, pm, level: pm.get('funding') == 'prepaid', 0.2, 'prepaid_card'),
+    (lambda amount, age, pm, level: _failed_3ds(pm), 0.4, 'failed_3ds'),
+    (lambda amount, age, pm, level: level == 'elevated', 0.3, 'stripe_elevated_risk'),
+    (lambda amount, age, pm, level: level == 'highest', 0.5, 'stripe_highest_risk'),
+)
+
+# PayPal predicates take (amount, payer_info)
+PAYPAL_RULES = (
+    (lambda amount, payer: amount > 1000, 0.2, 'high_amount'),
+    (lambda amount, payer: payer.get('status') == 'UNVERIFIED', 0.3, 'unverified_payer'),
+    (lambda amount, payer: bool(payer.get('country_code')) and payer['country_code'] != 'US',
+     0.1, 'international_transaction'),
+)
+
+@lru_cache(maxsize=4096)
+def _retrieve_customer(customer_id: str):
+    """Fetch a Stripe customer once per process; repeat customers are served from memory"""
+    return stripe.Customer.retrieve(customer_id)
+
 class StripeIntegration:
     def __init__(self, api_key: str = None):
         """Initialize Stripe integration"""
         self.api_key = api_key or os.getenv('STRIPE_SECRET_KEY')
         if self.api_key:
             stripe.api_key = self.api_key
+        # Every Stripe call in the process (charge pages, customer lookups) shares one budget
+        if not isinstance(stripe.default_http_client, _RateLimitedRequestsClient):
+            stripe.default_http_client = _RateLimitedRequestsClient(_stripe_rate_limiter)
         self.logger = logging.getLogger(__name__)
     
     def get_recent_charges(self, limit: int = 100, hours_back: int = 24) -> List[Dict]:
-        """Fetch recent charges from Stripe"""
+        """Fetch up to `limit` recent charges from Stripe, following pages past Stripe's 100-per-page cap"""
         try:
             # Calculate timestamp for filtering
-            since_timestamp = int((datetime.now() - timedelta(hours=hours_back)).timestamp())
+            since_timestamp = int(time.time() - hours_back * 3600)
             
+            # Customers arrive inline instead of costing one retrieve per charge
             charges = stripe.Charge.list(
-                limit=limit,
-                created={'gte': since_timestamp}
+                limit=min(limit, 100),
+                created={'gte': since_timestamp},
+                expand=['data.customer']
             )
             
-            processed_charges = []
-            for charge in charges.data:
-                processed_charge = self._process_stripe_charge(charge)
-                processed_charges.append(processed_charge)
-            
-            return processed_charges
+            return self._process_stripe_charges(list(islice(charges.auto_paging_iter(), limit)))
         
         except stripe.error.StripeError as e:
             self.logger.error(f"Stripe API error: {e}")
@@ -46,11 +132,29 @@ class StripeIntegration:
     
     def _process_stripe_charge(self, charge) -> Dict:
         """Process Stripe charge data into our format"""
+        details = self._extract_charge_details(charge)
+        risk_indicators = self._calculate_stripe_risk_indicators(charge, *details[:2], details[3])
+        return self._build_charge_record(charge, details, risk_indicators)
+    
+    def _process_stripe_charges(self, charges: List) -> List[Dict]:
+        """Process a page of Stripe charges, scoring their risk indicators together"""
+        details = [self._extract_charge_details(charge) for charge in charges]
+        risk_indicators = self._calculate_stripe_risk_indicators_batch(charges, details)
+        return [
+            self._build_charge_record(charge, charge_details, indicators)
+            for charge, charge_details, indicators in zip(charges, details, risk_indicators)
+        ]
+    
+    def _extract_charge_details(self, charge):
+        """Return (customer_info, payment_method, outcome, stripe_risk_level) for a charge"""
         # Extract customer information
         customer_info = {}
         if charge.customer:
             try:
-                customer = stripe.Customer.retrieve(charge.customer)
+                customer = charge.customer
+                if isinstance(customer, str):
+                    # Not expanded, e.g. from get_charge_details
+                    customer = _retrieve_customer(customer)
                 customer_info = {
                     'customer_id': customer.id,
                     'email': customer.email,
@@ -77,9 +181,12 @@ class StripeIntegration:
                     'wallet': pm_details.card.wallet
                 }
         
-        # Calculate risk indicators
-        risk_indicators = self._calculate_stripe_risk_indicators(charge, customer_info, payment_method)
-        
+        outcome = charge.outcome
+        stripe_risk_level = outcome.risk_level if outcome else 'normal'
+        return customer_info, payment_method, outcome, stripe_risk_level
+    
+    def _build_charge_record(self, charge, details, risk_indicators: Dict) -> Dict:
+        customer_info, payment_method, outcome, stripe_risk_level = details
         return {
             'transaction_id': charge.id,
             'amount': charge.amount / 100,  # Convert from cents
@@ -90,9 +197,9 @@ class StripeIntegration:
             'customer_info': customer_info,
             'payment_method': payment_method,
             'billing_details': charge.billing_details,
-            'outcome': charge.outcome,
-            'risk_level': charge.outcome.risk_level if charge.outcome else 'normal',
-            'seller_message': charge.outcome.seller_message if charge.outcome else None,
+            'outcome': outcome,
+            'risk_level': stripe_risk_level,
+            'seller_message': outcome.seller_message if outcome else None,
             'risk_indicators': risk_indicators,
             'metadata': charge.metadata,
             'receipt_email': charge.receipt_email,
@@ -100,54 +207,65 @@ class StripeIntegration:
             'statement_descriptor': charge.statement_descriptor
         }
     
-    def _calculate_stripe_risk_indicators(self, charge, customer_info: Dict, payment_method: Dict) -> Dict:
+    def _calculate_stripe_risk_indicators(self, charge, customer_info: Dict, payment_method: Dict,
+                                          stripe_risk_level: str = 'normal') -> Dict:
         """Calculate additional risk indicators from Stripe data"""
-        risk_score = 0.0
-        risk_factors = []
-        
-        # High amount risk
-        amount_usd = charge.amount / 100
-        if amount_usd > 1000:
-            risk_score += 0.2
-            risk_factors.append('high_amount')
-        
-        # New customer risk
+        account_age_days = None
         if customer_info and customer_info.get('created'):
-            account_age_days = (datetime.now().timestamp() - customer_info['created']) / 86400
-            if account_age_days < 7:
-                risk_score += 0.3
-                risk_factors.append('new_customer')
+            account_age_days = (time.time() - customer_info['created']) / 86400
         
-        # International card risk
-        if payment_method.get('country') and payment_method['country'] != 'US':
-            risk_score += 0.1
-            risk_factors.append('international_card')
-        
-        # Prepaid card risk
-        if payment_method.get('funding') == 'prepaid':
-            risk_score += 0.2
-            risk_factors.append('prepaid_card')
-        
-        # Failed 3D Secure
-        if payment_method.get('three_d_secure') and payment_method['three_d_secure'].get('result') == 'failed':
-            risk_score += 0.4
-            risk_factors.append('failed_3ds')
-        
-        # Stripe's own risk assessment
-        if charge.outcome:
-            if charge.outcome.risk_level == 'elevated':
-                risk_score += 0.3
-                risk_factors.append('stripe_elevated_risk')
-            elif charge.outcome.risk_level == 'highest':
-                risk_score += 0.5
-                risk_factors.append('stripe_highest_risk')
+        ctx = (charge.amount / 100, account_age_days, payment_method, stripe_risk_level)
+        hits = [(weight, factor) for predicate, weight, factor in STRIPE_RULES if predicate(*ctx)]
+        risk_score = sum(weight for weight, _ in hits)
+        risk_factors = [factor for _, factor in hits]
         
         return {
             'risk_score': min(risk_score, 1.0),
             'risk_factors': risk_factors,
-            'stripe_risk_level': charge.outcome.risk_level if charge.outcome else 'normal'
+            'stripe_risk_level': stripe_risk_level
         }
     
+    def _calculate_stripe_risk_indicators_batch(self, charges: List, details: List) -> List[Dict]:
+        """Vectorized _calculate_stripe_risk_indicators over many charges, with identical results"""
+        # One boolean mask per rule, accumulated in the per-charge order
+        n = len(charges)
+        if not n:
+            return []
+        
+        customer_infos = [d[0] for d in details]
+        payment_methods = [d[1] for d in details]
+        risk_levels = np.array([d[3] for d in details])
+        
+        amount_usd = np.fromiter((charge.amount for charge in charges), dtype=float, count=n) / 100
+        customer_created = np.fromiter(
+            (info.get('created') or np.nan for info in customer_infos), dtype=float, count=n
+        )
+        country = [pm.get('country') for pm in payment_methods]
+        
+        # One mask per STRIPE_RULES entry, in the same order; NaN ages compare False
+        masks = (
+            amount_usd > 1000,
+            (time.time() - customer_created) / 86400 < 7,
+            np.array([bool(c) and c != 'US' for c in country]),
+            np.array([pm.get('funding') == 'prepaid' for pm in payment_methods]),
+            np.array([_failed_3ds(pm) for pm in payment_methods]),
+            risk_levels == 'elevated',
+            risk_levels == 'highest',
+        )
+        
+        risk_scores = np.zeros(n)
+        risk_factors = [[] for _ in range(n)]
+        for mask, (_, score, factor) in zip(masks, STRIPE_RULES):
+            risk_scores[mask] += score
+            for i in np.flatnonzero(mask):
+                risk_factors[i].append(factor)
+        np.minimum(risk_scores, 1.0, out=risk_scores)
+        
+        return [
+            {'risk_score': score, 'risk_factors': factors, 'stripe_risk_level': level}
+            for score, factors, level in zip(risk_scores.tolist(), risk_factors, risk_levels.tolist())
+        ]
+    
     def create_webhook_endpoint(self, url: str, events: List[str] = None) -> Dict:
         """Create a webhook endpoint for real-time notifications"""
         if not events:
@@ -176,15 +294,81 @@ class StripeIntegration:
     
     def verify_webhook_signature(self, payload: bytes, sig_header: str, endpoint_secret: str) -> bool:
         """Verify webhook signature from Stripe"""
-        try:
-            stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
+        return self.verify_and_parse(payload, sig_header, endpoint_secret) is not None
+    
+    def verify_and_parse(self, payload: bytes, sig_header: str, endpoint_secret: str,
+                         event_data: Dict = None) -> Optional[stripe.Event]:
+        """Verify a webhook's signature and return its Event, or None if it is not authentic"""
+        # Pass event_data if the payload is already decoded; only the signature check
+        # reads the raw bytes
+        if isinstance(payload, str):
+            payload = payload.encode()
+        
+        signature_check = self._start_signature_check(sig_header, endpoint_secret)
+        if signature_check is None:
+            return None
+        mac, signatures = signature_check
+        mac.update(payload)
+        if not self._signature_matches(mac, signatures):
+            return None
+        
+        if event_data is None:
+            try:
+                event_data = json.loads(payload)
+            except ValueError:
+                self.logger.error("Invalid payload")
+                return None
+        return stripe.Event.construct_from(event_data, stripe.api_key)
+    
+    def read_verified_payload(self, stream, sig_header: str, endpoint_secret: str,
+                              tolerance: int = stripe.Webhook.DEFAULT_TOLERANCE) -> Optional[bytes]:
+        """Read a webhook body from `stream`, returning it only if its Stripe v1 signature is valid"""
+        # The HMAC is updated chunk by chunk instead of over a `{t}.{payload}` copy of the body,
+        # and the signed timestamp must be within `tolerance` seconds
+        signature_check = self._start_signature_check(sig_header, endpoint_secret, tolerance)
+        if signature_check is None:
+            return None
+        mac, signatures = signature_check
+        
+        chunks = []
+        for chunk in iter(lambda: stream.read(WEBHOOK_READ_CHUNK), b''):
+            mac.update(chunk)
+            chunks.append(chunk)
+        
+        if not self._signature_matches(mac, signatures):
+            return None
+        return b''.join(chunks)
+    
+    def _start_signature_check(self, sig_header: str, endpoint_secret: str,
+                               tolerance: int = stripe.Webhook.DEFAULT_TOLERANCE):
+        """Parse a Stripe-Signature header into (HMAC seeded with `{t}.`, v1 signatures)"""
+        # Returns None if the header is malformed or older than `tolerance` seconds;
+        # the caller feeds the body to the HMAC
+        timestamp = None
+        signatures = []
+        for item in (sig_header or '').split(','):
+            key, _, value = item.strip().partition('=')
+            if key == 't':
+                timestamp = value
+            elif key == 'v1':
+                signatures.append(value.encode())
+        
+        if not timestamp or not timestamp.isdigit() or not signatures:
+            self.logger.error("Invalid signature header")
+            return None
+        if int(timestamp) < time.time() - tolerance:
+            self.logger.error("Webhook timestamp outside the tolerance zone")
+            return None
+        
+        return hmac.new(endpoint_secret.encode(), timestamp.encode() + b'.', hashlib.sha256), signatures
+    
+    def _signature_matches(self, mac, signatures: List[bytes]) -> bool:
+        """Constant-time check of a finished HMAC against the header's v1 signatures"""
+        expected = mac.hexdigest().encode()
+        if any(hmac.compare_digest(expected, signature) for signature in signatures):
             return True
-        except ValueError:
-            self.logger.error("Invalid payload")
-            return False
-        except stripe.error.SignatureVerificationError:
-            self.logger.error("Invalid signature")
-            return False
+        self.logger.error("Invalid signature")
+        return False
 
 class PayPalIntegration:
     def __init__(self, client_id: str = None, client_secret: str = None, sandbox: bool = True):
@@ -194,10 +378,30 @@ class PayPalIntegration:
         self.sandbox = sandbox
         self.base_url = 'https://api.sandbox.paypal.com' if sandbox else 'https://api.paypal.com'
         self.access_token = None
+        self._token_expiry = 0.0  # time.monotonic() deadline for access_token
         self.logger = logging.getLogger(__name__)
+        
+        # Keep-alive session so calls reuse pooled TLS connections
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=50,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.25,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False
+            )
+        ))
+    
+    def _token_valid(self) -> bool:
+        return self.access_token is not None and time.monotonic() < self._token_expiry
     
     def get_access_token(self) -> str:
-        """Get OAuth access token from PayPal"""
+        """Get OAuth access token from PayPal, reusing the current one until it nears expiry"""
+        if self._token_valid():
+            return self.access_token
+        
         try:
             url = f"{self.base_url}/v1/oauth2/token"
             headers = {
@@ -206,15 +410,18 @@ class PayPalIntegration:
             }
             data = 'grant_type=client_credentials'
             
-            response = requests.post(
+            response = self.session.post(
                 url, 
                 headers=headers, 
                 data=data,
-                auth=(self.client_id, self.client_secret)
+                auth=(self.client_id, self.client_secret),
+                timeout=PAYPAL_TIMEOUT
             )
             
             if response.status_code == 200:
-                self.access_token = response.json()['access_token']
+                token = response.json()
+                self.access_token = token['access_token']
+                self._token_expiry = time.monotonic() + token.get('expires_in', 0) - TOKEN_EXPIRY_MARGIN
                 return self.access_token
             else:
                 self.logger.error(f"Failed to get PayPal access token: {response.text}")
@@ -226,7 +433,7 @@ class PayPalIntegration:
     
     def get_payment_details(self, payment_id: str) -> Optional[Dict]:
         """Get payment details from PayPal"""
-        if not self.access_token:
+        if not self._token_valid():
             self.get_access_token()
         
         try:
@@ -236,7 +443,7 @@ class PayPalIntegration:
                 'Authorization': f'Bearer {self.access_token}'
             }
             
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers, timeout=PAYPAL_TIMEOUT)
             
             if response.status_code == 200:
                 payment_data = response.json()
@@ -251,24 +458,20 @@ class PayPalIntegration:
     
     def _process_paypal_payment(self, payment_data: Dict) -> Dict:
         """Process PayPal payment data into our format"""
-        # Extract transaction details
-        transactions = payment_data.get('transactions', [])
+        # Every nested object is looked up once and held in a local
+        transactions = payment_data.get('transactions')
         if not transactions:
             return {}
         
         transaction = transactions[0]
-        amount = transaction.get('amount', {})
-        
-        # Extract payer information
-        payer = payment_data.get('payer', {})
-        payer_info = payer.get('payer_info', {})
-        
-        # Calculate risk indicators
-        risk_indicators = self._calculate_paypal_risk_indicators(payment_data)
+        amount = transaction.get('amount') or {}
+        total = float(amount.get('total', 0))
+        payer = payment_data.get('payer') or {}
+        payer_info = payer.get('payer_info') or {}
         
         return {
             'transaction_id': payment_data.get('id'),
-            'amount': float(amount.get('total', 0)),
+            'amount': total,
             'currency': amount.get('currency'),
             'status': payment_data.get('state'),
             'created': payment_data.get('create_time'),
@@ -277,7 +480,7 @@ class PayPalIntegration:
             'payer_status': payer_info.get('status'),
             'country_code': payer_info.get('country_code'),
             'payment_method': payer.get('payment_method'),
-            'risk_indicators': risk_indicators,
+            'risk_indicators': self._paypal_risk_indicators(total, payer_info),
             'description': transaction.get('description'),
             'item_list': transaction.get('item_list', {}),
             'related_resources': transaction.get('related_resources', [])
@@ -285,32 +488,18 @@ class PayPalIntegration:
     
     def _calculate_paypal_risk_indicators(self, payment_data: Dict) -> Dict:
         """Calculate risk indicators from PayPal data"""
-        risk_score = 0.0
-        risk_factors = []
-        
-        # Check transaction amount
-        transactions = payment_data.get('transactions', [])
-        if transactions:
-            amount = float(transactions[0].get('amount', {}).get('total', 0))
-            if amount > 1000:
-                risk_score += 0.2
-                risk_factors.append('high_amount')
-        
-        # Check payer status
-        payer_info = payment_data.get('payer', {}).get('payer_info', {})
-        if payer_info.get('status') == 'UNVERIFIED':
-            risk_score += 0.3
-            risk_factors.append('unverified_payer')
-        
-        # Check for international transactions
-        country_code = payer_info.get('country_code')
-        if country_code and country_code != 'US':
-            risk_score += 0.1
-            risk_factors.append('international_transaction')
+        transactions = payment_data.get('transactions')
+        amount = float((transactions[0].get('amount') or {}).get('total', 0)) if transactions else 0.0
+        payer_info = (payment_data.get('payer') or {}).get('payer_info') or {}
+        return self._paypal_risk_indicators(amount, payer_info)
+    
+    def _paypal_risk_indicators(self, amount: float, payer_info: Dict) -> Dict:
+        """Evaluate PAYPAL_RULES against an already-extracted amount and payer_info"""
+        hits = [(weight, factor) for predicate, weight, factor in PAYPAL_RULES if predicate(amount, payer_info)]
         
         return {
-            'risk_score': min(risk_score, 1.0),
-            'risk_factors': risk_factors
+            'risk_score': min(sum(weight for weight, _ in hits), 1.0),
+            'risk_factors': [factor for _, factor in hits]
         }
 
 # Example usage and testing
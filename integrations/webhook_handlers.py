@@ -1,30 +1,172 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 import stripe
-import json
+import requests
 import hmac
 import hashlib
+import base64
+import json
+import os
+import zlib
+import time
+import threading
+from functools import lru_cache
+from urllib.parse import urlparse
+from collections import OrderedDict
+from queue import Queue, Full, Empty
 from datetime import datetime
 import logging
-from fraud_detection_model import FraudDetectionModel
-from database import FraudDatabase
-from integrations.stripe_integration import StripeIntegration
-from integrations.fraud_databases import FraudDatabaseManager
+import numpy as np
+from fraud_detection_model import RISK_LABELS, RISK_THRESHOLDS
+from config import config
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:  # only needed to verify PayPal webhooks, which are rejected without it
+    x509 = None
 
 # Create blueprint for webhook handlers
 webhooks_bp = Blueprint('webhooks', __name__, url_prefix='/webhooks')
 
-# Initialize components
-fraud_detector = FraudDetectionModel()
-db = FraudDatabase()
-stripe_integration = StripeIntegration()
-fraud_db_manager = FraudDatabaseManager()
+# The app's services, set when the blueprint is registered (see _init_services); the
+# Stripe and fraud database integrations come from the app's lazy factories
+fraud_detector = None
+db = None
+get_stripe_integration = None
+get_fraud_db_manager = None
 
 logger = logging.getLogger(__name__)
 
+# Succeeded charges are scored by background workers so the webhook is acknowledged
+# without waiting on the model, MaxMind/Sift and the database. Each accepted charge is
+# also written to the pending_charges table and only removed once its result is stored
+SCORING_WORKERS = 2
+# A worker collects charges arriving within this window (up to the max) and scores
+# them together, so bursts share one model call, one external fan-out and one commit
+SCORING_BATCH_MAX = 50
+SCORING_BATCH_WINDOW = 0.05
+scoring_queue = Queue(maxsize=1000)
+_pending_charge_ids = set()  # queued or being scored, to drop redeliveries
+_pending_lock = threading.Lock()
+
+# Stripe never redelivers an event it got a 202 for, so charges left in pending_charges
+# (failed scoring, or a process that stopped) are requeued by a background loop. Rows
+# younger than PENDING_RETRY_AGE may still be in another worker process's queue, and a
+# charge that keeps failing waits twice as long after each attempt
+PENDING_RETRY_INTERVAL = 30  # seconds between scans
+PENDING_RETRY_AGE = 60
+PENDING_RETRY_MAX_DELAY = 3600
+_retry_backoff = {}  # charge id -> (failed attempts, time.monotonic() of next retry)
+
+def _scoring_worker():
+    while True:
+        items = [scoring_queue.get()]  # (event_id, charge) pairs
+        deadline = time.monotonic() + SCORING_BATCH_WINDOW
+        while len(items) < SCORING_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(scoring_queue.get(timeout=remaining))
+            except Empty:
+                break
+        
+        charges = [charge for _, charge in items]
+        try:
+            _score_and_settle(items)
+        except Exception as e:
+            if len(items) == 1:
+                logger.error(f"Error scoring Stripe charge {charges[0]['id']}: {e}")
+                _back_off(charges[0]['id'])
+            else:
+                # Retry one by one, so a single bad charge cannot keep the rest of its
+                # batch from being stored
+                logger.warning(f"Error scoring {len(items)} Stripe charges, retrying individually: {e}")
+                for item in items:
+                    try:
+                        _score_and_settle([item])
+                    except Exception as item_error:
+                        logger.error(f"Error scoring Stripe charge {item[1]['id']}: {item_error}")
+                        _back_off(item[1]['id'])
+        finally:
+            with _pending_lock:
+                _pending_charge_ids.difference_update(charge['id'] for charge in charges)
+            for _ in items:
+                scoring_queue.task_done()
+
+def _score_and_settle(items):
+    """Score and store (event_id, charge) pairs, then retire their pending rows and events"""
+    charges = [charge for _, charge in items]
+    score_stripe_charges(charges)
+    db.delete_pending_charges([charge['id'] for charge in charges])
+    with _pending_lock:
+        for charge in charges:
+            _retry_backoff.pop(charge['id'], None)
+    # Only now is a redelivery of these events a duplicate
+    for event_id, _ in items:
+        if event_id:
+            _mark_event_handled(event_id)
+
+def _back_off(charge_id):
+    """Push a failed charge's next retry out, doubling the delay each time"""
+    with _pending_lock:
+        attempts = _retry_backoff.get(charge_id, (0, 0))[0] + 1
+        delay = min(PENDING_RETRY_INTERVAL * 2 ** attempts, PENDING_RETRY_MAX_DELAY)
+        _retry_backoff[charge_id] = (attempts, time.monotonic() + delay)
+
+def _requeue_pending_charges():
+    """Queue unscored charges from pending_charges whose retry is due"""
+    now = time.monotonic()
+    for row in db.get_pending_charges(min_age=PENDING_RETRY_AGE):
+        charge_id = row['charge_id']
+        with _pending_lock:
+            if charge_id in _pending_charge_ids or _retry_backoff.get(charge_id, (0, 0))[1] > now:
+                continue
+            _pending_charge_ids.add(charge_id)
+        charge = stripe.Charge.construct_from(json.loads(row['payload']), stripe.api_key)
+        scoring_queue.put((row['event_id'], charge))
+
+def _retry_pending_charges():
+    while True:
+        try:
+            _requeue_pending_charges()
+        except Exception as e:
+            logger.error(f"Error requeueing pending Stripe charges: {e}")
+        time.sleep(PENDING_RETRY_INTERVAL)
+
+def _start_scoring_workers():
+    for _ in range(SCORING_WORKERS):
+        threading.Thread(target=_scoring_worker, daemon=True, name='stripe-scoring').start()
+    threading.Thread(target=_retry_pending_charges, daemon=True, name='stripe-retry').start()
+
+# Stripe event IDs handled successfully, kept for Stripe's 72 hour redelivery window so a
+# redelivered event is answered as a duplicate without being processed again. The check
+# runs after signature verification, so every delivery still pays for the HMAC. Queued
+# charge.succeeded events are added by the scoring worker once stored
+EVENT_DEDUP_TTL = 72 * 3600
+EVENT_DEDUP_MAX = 100_000
+_handled_events = OrderedDict()  # event id -> time.monotonic() expiry, oldest first
+_handled_events_lock = threading.Lock()
+
+def _event_already_handled(event_id):
+    now = time.monotonic()
+    with _handled_events_lock:
+        while _handled_events and next(iter(_handled_events.values())) <= now:
+            _handled_events.popitem(last=False)
+        return event_id in _handled_events
+
+def _mark_event_handled(event_id):
+    with _handled_events_lock:
+        _handled_events[event_id] = time.monotonic() + EVENT_DEDUP_TTL
+        _handled_events.move_to_end(event_id)
+        if len(_handled_events) > EVENT_DEDUP_MAX:
+            _handled_events.popitem(last=False)
+
 @webhooks_bp.route('/stripe', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe webhook events"""
-    payload = request.get_data()
     sig_header = request.headers.get('Stripe-Signature')
     endpoint_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
     
@@ -32,101 +174,136 @@ def stripe_webhook():
         logger.error("Stripe webhook secret not configured")
         return jsonify({'error': 'Webhook secret not configured'}), 500
     
-    # Verify webhook signature
-    if not stripe_integration.verify_webhook_signature(payload, sig_header, endpoint_secret):
+    # The signature is checked while the body streams in, before anything is parsed
+    payload = get_stripe_integration().read_verified_payload(request.stream, sig_header, endpoint_secret)
+    if payload is None:
         return jsonify({'error': 'Invalid signature'}), 400
     
+    # Parsed once, with the app's JSON provider (orjson-backed when orjson is installed)
+    try:
+        event_data = current_app.json.loads(payload)
+    except ValueError:
+        return jsonify({'error': 'Invalid payload'}), 400
+    
+    event_id = event_data.get('id') if isinstance(event_data, dict) else None
+    if event_id and _event_already_handled(event_id):
+        return jsonify({'status': 'duplicate', 'event_id': event_id}), 200
+    
+    event = stripe.Event.construct_from(event_data, stripe.api_key)
+    
     try:
-        event = json.loads(payload)
-        
         # Handle different event types
-        if event['type'] == 'charge.succeeded':
-            return handle_stripe_charge_succeeded(event)
-        elif event['type'] == 'charge.failed':
-            return handle_stripe_charge_failed(event)
-        elif event['type'] == 'charge.dispute.created':
-            return handle_stripe_dispute_created(event)
-        elif event['type'] == 'payment_intent.succeeded':
-            return handle_stripe_payment_intent_succeeded(event)
-        else:
-            logger.info(f"Unhandled Stripe event type: {event['type']}")
-            return jsonify({'status': 'ignored'}), 200
+        handler = STRIPE_HANDLERS.get(event['type'], _ignore_stripe_event)
+        response = handler(event)
+        
+        # 202 means queued for scoring; the worker marks the event once the result is stored
+        if event_id and response[1] < 300 and response[1] != 202:
+            _mark_event_handled(event_id)
+        return response
     
     except Exception as e:
         logger.error(f"Error processing Stripe webhook: {e}")
         return jsonify({'error': 'Webhook processing failed'}), 500
 
 def handle_stripe_charge_succeeded(event):
-    """Handle successful Stripe charge"""
+    """Handle successful Stripe charge by queueing it for scoring"""
     charge = event['data']['object']
     
-    # Convert Stripe charge to our transaction format
-    transaction_data = stripe_integration._process_stripe_charge(charge)
+    # Redelivered events for a charge we already stored need no re-scoring
+    if db.is_known_transaction(charge['id']):
+        return jsonify({'status': 'duplicate', 'transaction_id': charge['id']}), 200
+    
+    with _pending_lock:
+        if charge['id'] in _pending_charge_ids:
+            # Still being scored, so this event is not handled yet either
+            return jsonify({'status': 'queued', 'transaction_id': charge['id']}), 202
+        if scoring_queue.full():
+            # Stripe retries non-2xx deliveries, so shed load instead of blocking the worker
+            logger.warning(f"Scoring queue full, deferring Stripe charge {charge['id']}")
+            return jsonify({'error': 'Scoring backlog full'}), 503
+        # Persisted before the 202, so an accepted charge survives a restart
+        event_id = getattr(event, 'id', None)
+        db.save_pending_charge(charge['id'], event_id, json.dumps(charge.to_dict()))
+        try:
+            scoring_queue.put_nowait((event_id, charge))
+        except Full:
+            # Filled by the retry loop; the saved row is replaced on redelivery
+            return jsonify({'error': 'Scoring backlog full'}), 503
+        _pending_charge_ids.add(charge['id'])
+    
+    return jsonify({'status': 'queued', 'transaction_id': charge['id']}), 202
+
+def score_stripe_charges(charges):
+    """Score a batch of Stripe charges and store the results, alerting on high risk"""
+    # Convert Stripe charges to our transaction format
+    transactions = get_stripe_integration()._process_stripe_charges(charges)
     
     # Prepare data for fraud analysis
-    fraud_analysis_data = {
-        'transaction_id': transaction_data['transaction_id'],
-        'user_id': transaction_data.get('customer_info', {}).get('customer_id', 'unknown'),
-        'amount': transaction_data['amount'],
-        'currency': transaction_data['currency'],
-        'email': transaction_data.get('customer_info', {}).get('email'),
-        'payment_processor': 'stripe',
-        'billing_country': transaction_data.get('billing_details', {}).get('address', {}).get('country'),
-        'card_country': transaction_data.get('payment_method', {}).get('country'),
-        'card_funding': transaction_data.get('payment_method', {}).get('funding'),
-        'timestamp': transaction_data['created'].isoformat()
-    }
-    
-    # Analyze with our fraud detection model
-    fraud_prediction = fraud_detector.predict_fraud(fraud_analysis_data)
-    
-    # Analyze with external fraud databases
-    external_analysis = fraud_db_manager.analyze_transaction(fraud_analysis_data)
-    
-    # Combine results
-    combined_risk_score = (fraud_prediction['fraud_probability'] + external_analysis['combined_risk_score']) / 2
-    combined_risk_factors = fraud_prediction.get('risk_factors', []) + external_analysis.get('risk_factors', [])
-    
-    # Update prediction with combined results
-    fraud_prediction['fraud_probability'] = combined_risk_score
-    fraud_prediction['risk_level'] = _get_risk_level(combined_risk_score)
-    fraud_prediction['external_analysis'] = external_analysis
-    
-    # Store in database
-    db.insert_transaction(fraud_analysis_data, fraud_prediction)
-    
-    # Create alert if high risk
-    if fraud_prediction['risk_level'] == 'High':
-        db.create_fraud_alert(
-            transaction_data['transaction_id'],
-            'High Risk Stripe Transaction',
-            'Critical',
-            f"Real-time Stripe transaction flagged as high risk (score: {combined_risk_score:.2%})"
-        )
+    analysis_rows = []
+    for transaction_data in transactions:
+        billing_details = transaction_data.get('billing_details')
+        billing_address = billing_details['address'] if billing_details else None
+        analysis_rows.append({
+            'transaction_id': transaction_data['transaction_id'],
+            'user_id': transaction_data.get('customer_info', {}).get('customer_id', 'unknown'),
+            'amount': transaction_data['amount'],
+            'currency': transaction_data['currency'],
+            'email': transaction_data.get('customer_info', {}).get('email'),
+            'payment_processor': 'stripe',
+            'billing_country': billing_address['country'] if billing_address else None,
+            'card_country': transaction_data.get('payment_method', {}).get('country'),
+            'card_funding': transaction_data.get('payment_method', {}).get('funding'),
+            'timestamp': transaction_data['created'].isoformat()
+        })
+    
+    # Analyze with our fraud detection model and the external fraud databases
+    fraud_predictions = fraud_detector.predict_fraud_batch(analysis_rows)
+    external_analyses = get_fraud_db_manager().analyze_transactions_batch(analysis_rows)
+    
+    # Combine results across the whole batch
+    model_probs = np.array([prediction['fraud_probability'] for prediction in fraud_predictions])
+    external_scores = np.array([analysis['combined_risk_score'] for analysis in external_analyses])
+    combined_scores = (model_probs + external_scores) / 2
+    risk_levels = RISK_LABELS[np.searchsorted(RISK_THRESHOLDS, combined_scores, side='right')]
+    
+    tx_rows = []
+    alert_rows = []
+    for fraud_analysis_data, fraud_prediction, external_analysis, combined_risk_score, risk_level in zip(
+            analysis_rows, fraud_predictions, external_analyses,
+            combined_scores.tolist(), risk_levels.tolist()):
+        # Update prediction with combined results
+        fraud_prediction['fraud_probability'] = combined_risk_score
+        fraud_prediction['risk_level'] = risk_level
+        fraud_prediction['external_analysis'] = external_analysis
         
-        # Log high-risk transaction
-        logger.warning(f"High-risk Stripe transaction detected: {transaction_data['transaction_id']}")
-    
-    return jsonify({
-        'status': 'processed',
-        'transaction_id': transaction_data['transaction_id'],
-        'fraud_score': combined_risk_score,
-        'risk_level': fraud_prediction['risk_level']
-    }), 200
+        tx_rows.append((fraud_analysis_data, fraud_prediction))
+        if risk_level == 'High':
+            alert_rows.append((
+                fraud_analysis_data['transaction_id'],
+                'High Risk Stripe Transaction',
+                'Critical',
+                f"Real-time Stripe transaction flagged as high risk (score: {combined_risk_score:.2%})"
+            ))
+            logger.warning(f"High-risk Stripe transaction detected: {fraud_analysis_data['transaction_id']}")
+    
+    # Store the batch and its alerts in one commit
+    db.insert_transactions_bulk(tx_rows, alert_rows)
+    
+    return fraud_predictions
 
 def handle_stripe_charge_failed(event):
     """Handle failed Stripe charge"""
     charge = event['data']['object']
     
     # Log failed charge for analysis
-    logger.info(f"Stripe charge failed: {charge['id']}, reason: {charge.get('failure_message')}")
+    logger.info(f"Stripe charge failed: {charge['id']}, reason: {charge['failure_message']}")
     
     # Store failed transaction data
     transaction_data = {
         'transaction_id': charge['id'],
         'amount': charge['amount'] / 100,
         'status': 'failed',
-        'failure_reason': charge.get('failure_message'),
+        'failure_reason': charge['failure_message'],
         'timestamp': datetime.now().isoformat()
     }
     
@@ -170,35 +347,78 @@ def handle_stripe_payment_intent_succeeded(event):
     
     return jsonify({'status': 'processed'}), 200
 
+def _ignore_stripe_event(event):
+    logger.info(f"Unhandled Stripe event type: {event['type']}")
+    return jsonify({'status': 'ignored'}), 200
+
+# Stripe event type -> handler, looked up once per webhook
+STRIPE_HANDLERS = {
+    'charge.succeeded': handle_stripe_charge_succeeded,
+    'charge.failed': handle_stripe_charge_failed,
+    'charge.dispute.created': handle_stripe_dispute_created,
+    'payment_intent.succeeded': handle_stripe_payment_intent_succeeded,
+}
+
 @webhooks_bp.route('/paypal', methods=['POST'])
 def paypal_webhook():
     """Handle PayPal webhook events"""
+    webhook_id = config.PAYPAL_WEBHOOK_ID
+    if not webhook_id:
+        logger.error("PayPal webhook ID not configured")
+        return jsonify({'error': 'Webhook ID not configured'}), 500
+    
     try:
         # Verify PayPal webhook signature
-        if not verify_paypal_webhook():
+        if not verify_paypal_webhook(request.get_data(), webhook_id):
             return jsonify({'error': 'Invalid signature'}), 400
         
         event_data = request.get_json()
-        event_type = event_data.get('event_type')
-        
-        if event_type == 'PAYMENT.CAPTURE.COMPLETED':
-            return handle_paypal_payment_completed(event_data)
-        elif event_type == 'PAYMENT.CAPTURE.DENIED':
-            return handle_paypal_payment_denied(event_data)
-        else:
-            logger.info(f"Unhandled PayPal event type: {event_type}")
-            return jsonify({'status': 'ignored'}), 200
+        handler = PAYPAL_HANDLERS.get(event_data.get('event_type'), _ignore_paypal_event)
+        return handler(event_data)
     
     except Exception as e:
         logger.error(f"Error processing PayPal webhook: {e}")
         return jsonify({'error': 'Webhook processing failed'}), 500
 
-def verify_paypal_webhook():
+@lru_cache(maxsize=8)
+def _paypal_cert_public_key(cert_url):
+    """Download and parse a PayPal signing certificate once per URL"""
+    response = requests.get(cert_url, timeout=(3.05, 10))
+    response.raise_for_status()
+    return x509.load_pem_x509_certificate(response.content).public_key()
+
+def verify_paypal_webhook(payload, webhook_id):
     """Verify PayPal webhook signature"""
-    # PayPal webhook verification logic
-    # This is a simplified version - implement proper verification
-    webhook_id = request.headers.get('PAYPAL-TRANSMISSION-ID')
-    return webhook_id is not None
+    # PayPal signs "<transmission id>|<transmission time>|<webhook id>|<CRC32 of body>"
+    # with RSA-SHA256, using the certificate named in PAYPAL-CERT-URL
+    headers = request.headers
+    transmission_id = headers.get('PAYPAL-TRANSMISSION-ID')
+    transmission_time = headers.get('PAYPAL-TRANSMISSION-TIME')
+    signature = headers.get('PAYPAL-TRANSMISSION-SIG')
+    cert_url = headers.get('PAYPAL-CERT-URL')
+    if not (transmission_id and transmission_time and signature and cert_url):
+        return False
+    
+    if x509 is None:
+        logger.error("Cannot verify PayPal webhook: the cryptography package is not installed")
+        return False
+    
+    # The certificate URL comes from the request, so only PayPal-hosted certificates are trusted
+    parsed = urlparse(cert_url)
+    if parsed.scheme != 'https' or not (parsed.hostname or '').endswith('.paypal.com'):
+        logger.warning(f"Rejected PayPal webhook with untrusted cert URL: {cert_url}")
+        return False
+    
+    message = f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(payload)}"
+    try:
+        public_key = _paypal_cert_public_key(cert_url)
+        public_key.verify(base64.b64decode(signature), message.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return True
+    except InvalidSignature:
+        return False
+    except Exception as e:
+        logger.error(f"Error verifying PayPal webhook: {e}")
+        return False
 
 def handle_paypal_payment_completed(event_data):
     """Handle completed PayPal payment"""
@@ -247,6 +467,16 @@ def handle_paypal_payment_denied(event_data):
     
     return jsonify({'status': 'logged'}), 200
 
+def _ignore_paypal_event(event_data):
+    logger.info(f"Unhandled PayPal event type: {event_data.get('event_type')}")
+    return jsonify({'status': 'ignored'}), 200
+
+# PayPal event type -> handler, looked up once per webhook
+PAYPAL_HANDLERS = {
+    'PAYMENT.CAPTURE.COMPLETED': handle_paypal_payment_completed,
+    'PAYMENT.CAPTURE.DENIED': handle_paypal_payment_denied,
+}
+
 @webhooks_bp.route('/test', methods=['POST'])
 def test_webhook():
     """Test webhook endpoint for development"""
@@ -266,15 +496,6 @@ def test_webhook():
     
     return jsonify({'status': 'test_received'}), 200
 
-def _get_risk_level(probability):
-    """Convert probability to risk level"""
-    if probability < 0.3:
-        return 'Low'
-    elif probability < 0.7:
-        return 'Medium'
-    else:
-        return 'High'
-
 # Error handlers
 @webhooks_bp.errorhandler(400)
 def bad_request(error):
@@ -283,3 +504,34 @@ def bad_request(error):
 @webhooks_bp.errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
+
+# One prediction at registration so the first real webhook doesn't pay for the cold
+# model path (lazy artifacts, first-call allocations); set WEBHOOK_WARMUP=0 to skip
+_WARMUP = {
+    'transaction_id': 'warmup',
+    'user_id': 'warmup',
+    'amount': 100.0,
+    'currency': 'usd',
+    'email': None,
+    'payment_processor': 'stripe',
+    'billing_country': 'US',
+    'card_country': 'US',
+    'card_funding': 'credit',
+    'timestamp': datetime.now().isoformat()
+}
+
+@webhooks_bp.record_once
+def _init_services(state):
+    """Share the registering app's services, passed as register_blueprint options"""
+    global fraud_detector, db, get_stripe_integration, get_fraud_db_manager
+    fraud_detector = state.options['fraud_detector']
+    db = state.options['db']
+    get_stripe_integration = state.options['get_stripe_integration']
+    get_fraud_db_manager = state.options['get_fraud_db_manager']
+    _start_scoring_workers()
+    
+    if os.getenv('WEBHOOK_WARMUP', '1') == '1' and fraud_detector.is_trained:
+        try:
+            fraud_detector.predict_fraud_batch([_WARMUP])
+        except Exception as e:
+            logger.warning(f"Model warm-up failed: {e}")
@@ -1,43 +1,107 @@
 import asyncio
+import bisect
 import aiohttp
 import json
+import os
 from datetime import datetime, timedelta
 import logging
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import threading
 import time
-from queue import Queue
-from fraud_detection_model import FraudDetectionModel
-from database import FraudDatabase
+from collections import deque
+from queue import Queue, Empty
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from fraud_detection_model import FraudDetectionModel, RISK_LABELS, RISK_THRESHOLDS
+from database import FraudDatabase, WriteBehindLogger
 from integrations.stripe_integration import StripeIntegration
 from integrations.fraud_databases import FraudDatabaseManager
 
+try:
+    import orjson
+except ImportError:  # optional speedup; alerts are serialized with the json module without it
+    orjson = None
+
+# Configured combined-score cut points as plain tuples for bisect: below the low
+# threshold is Low, below the high one Medium, otherwise High
+RISK_LEVELS = tuple(RISK_LABELS.tolist())
+RISK_CUTOFFS = tuple(RISK_THRESHOLDS.tolist())
+
+def _alert_body(alert_data: Dict) -> bytes:
+    """Serialize an alert webhook payload to UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(alert_data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(alert_data).encode()
+
+def _velocity_kernel(amounts: np.ndarray, target_amount: float) -> Tuple[int, float, float]:
+    """Return (count, mean, deviation of target_amount from the mean) for a user's recent amounts"""
+    count = amounts.size
+    avg_amount = float(amounts.mean())
+    amount_deviation = abs(target_amount - avg_amount) / max(avg_amount, 1) if avg_amount > 0 else 0
+    return count, avg_amount, amount_deviation
+
 class RealTimeFraudProcessor:
     """Real-time fraud detection processor for live transactions"""
     
-    def __init__(self):
-        self.fraud_detector = FraudDetectionModel()
-        self.db = FraudDatabase()
-        self.stripe_integration = StripeIntegration()
-        self.fraud_db_manager = FraudDatabaseManager()
+    def __init__(self, fraud_detector: FraudDetectionModel = None, db: FraudDatabase = None,
+                 stripe_integration: StripeIntegration = None,
+                 fraud_db_manager: FraudDatabaseManager = None):
+        # Services not passed in (e.g. when run standalone) are created here
+        if fraud_detector is None:
+            fraud_detector = FraudDetectionModel()
+            fraud_detector.load_models()
+        self.fraud_detector = fraud_detector
+        self.db = db or FraudDatabase()
+        self.stripe_integration = stripe_integration or StripeIntegration()
+        self.fraud_db_manager = fraud_db_manager or FraudDatabaseManager()
+        
+        # Configuration
+        self.max_processing_threads = 5
+        self.max_alert_threads = 2
+        self.batch_size = 10
+        self.processing_interval = 1  # seconds
+        # Recent rows fetched once per batch for the velocity features
+        self.recent_window = 1000
         
         # Processing queues
-        self.transaction_queue = Queue()
+        # Transactions are sharded by user, one shard per processing thread, so a user's
+        # transactions and running aggregates are only ever touched by one worker. Each
+        # shard is a deque guarded by one condition, so a worker takes a whole batch per
+        # lock acquisition instead of locking once per item.
+        self.transaction_queues = [deque() for _ in range(self.max_processing_threads)]
+        self._queue_cvs = [threading.Condition() for _ in range(self.max_processing_threads)]
         self.alert_queue = Queue()
         
         # Processing threads
         self.processing_threads = []
         self.alert_threads = []
         
-        # Configuration
-        self.max_processing_threads = 5
-        self.max_alert_threads = 2
-        self.batch_size = 10
-        self.processing_interval = 1  # seconds
+        # Single background writer, so scoring threads never wait on SQLite commits
+        self.write_logger = WriteBehindLogger(
+            self.db, max_batch=self.batch_size, max_pending=10 * self.batch_size
+        )
+        
+        # Per-user [transaction count, amount total, fraud count], seeded from the database
+        # once and then kept current as transactions are scored; one dict per shard, owned
+        # by that shard's worker, so no locking is needed
+        self._user_aggs = [{} for _ in range(self.max_processing_threads)]
+        for user_id, count, total_amount, fraud_count in self.db.iter_user_totals():
+            self._user_aggs[self._shard_of(user_id)][user_id] = np.array(
+                [count, total_amount, fraud_count], dtype=float
+            )
+        
+        # Keep-alive pool for alert webhooks, so bursts of alerts to the same endpoint
+        # reuse connections instead of paying a TCP/TLS handshake each
+        self.alert_session = requests.Session()
+        alert_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_alert_threads)
+        self.alert_session.mount('https://', alert_adapter)
+        self.alert_session.mount('http://', alert_adapter)
         
         # Statistics
         self.processed_count = 0
         self.fraud_detected_count = 0
+        self._stats_lock = threading.Lock()  # counters are bumped once per batch
         self.start_time = datetime.now()
         
         self.logger = logging.getLogger(__name__)
@@ -48,8 +112,8 @@ class RealTimeFraudProcessor:
         self.running = True
         
         # Start processing threads
-        for i in range(self.max_processing_threads):
-            thread = threading.Thread(target=self._process_transactions, daemon=True)
+        for shard in range(self.max_processing_threads):
+            thread = threading.Thread(target=self._process_transactions, args=(shard,), daemon=True)
             thread.start()
             self.processing_threads.append(thread)
         
@@ -71,29 +135,35 @@ class RealTimeFraudProcessor:
     def stop(self):
         """Stop the real-time processing system"""
         self.running = False
+        self.write_logger.flush()
         self.logger.info("Real-time fraud processor stopped")
     
     def add_transaction(self, transaction_data: Dict):
         """Add transaction to processing queue"""
         transaction_data['received_at'] = datetime.now().isoformat()
-        self.transaction_queue.put(transaction_data)
+        shard = self._shard_of(transaction_data.get('user_id'))
+        with self._queue_cvs[shard]:
+            self.transaction_queues[shard].append(transaction_data)
+            self._queue_cvs[shard].notify()
     
-    def _process_transactions(self):
-        """Process transactions from the queue"""
+    def _shard_of(self, user_id) -> int:
+        """Index of the queue shard (and worker) that owns a user"""
+        return hash(user_id) % self.max_processing_threads
+    
+    def _process_transactions(self, shard: int):
+        """Process transactions from one queue shard"""
+        queue = self.transaction_queues[shard]
+        queue_cv = self._queue_cvs[shard]
         while self.running:
             try:
-                # Get batch of transactions
-                transactions = []
-                for _ in range(self.batch_size):
-                    if not self.transaction_queue.empty():
-                        transactions.append(self.transaction_queue.get())
-                    else:
-                        break
+                # Block until a transaction arrives (waking as soon as one is added, rather
+                # than polling), then take up to a batch of what is queued
+                with queue_cv:
+                    if not queue_cv.wait_for(lambda: queue, self.processing_interval):
+                        continue
+                    transactions = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
                 
-                if transactions:
-                    self._process_transaction_batch(transactions)
-                else:
-                    time.sleep(self.processing_interval)
+                self._process_transaction_batch(transactions)
             
             except Exception as e:
                 self.logger.error(f"Error in transaction processing thread: {e}")
@@ -101,49 +171,106 @@ class RealTimeFraudProcessor:
     
     def _process_transaction_batch(self, transactions: List[Dict]):
         """Process a batch of transactions"""
+        start_ns = time.monotonic_ns()
+        
+        # One recent-transactions read and one clock reading serve every transaction in the batch
+        recent_by_user = self._index_recent_transactions()
+        now = datetime.now()
+        time_features = {
+            'hour_of_day': now.hour,
+            'day_of_week': now.weekday(),
+            'is_weekend': 1 if now.weekday() >= 5 else 0
+        }
+        velocity_cutoff = np.datetime64(now - timedelta(hours=24), 'us')
+        
+        # Enrich transaction data
+        enriched_batch = []
         for transaction_data in transactions:
             try:
-                start_time = time.time()
-                
-                # Enrich transaction data
-                enriched_data = self._enrich_transaction_data(transaction_data)
-                
-                # Run fraud detection
-                fraud_prediction = self.fraud_detector.predict_fraud(enriched_data)
-                
-                # Run external fraud analysis
-                external_analysis = self.fraud_db_manager.analyze_transaction(enriched_data)
-                
+                enriched_batch.append(self._enrich_transaction_data(
+                    transaction_data, recent_by_user, time_features, velocity_cutoff
+                ))
+            except Exception as e:
+                self.logger.error(f"Error enriching transaction: {e}")
+        if not enriched_batch:
+            return
+        
+        # Run fraud detection as one vectorized model call, and the external fraud
+        # analysis with its API round-trips overlapped
+        try:
+            fraud_predictions = self.fraud_detector.predict_fraud_batch(enriched_batch)
+            external_analyses = self.fraud_db_manager.analyze_transactions_batch(enriched_batch)
+        except Exception as e:
+            self.logger.error(f"Error scoring transaction batch: {e}")
+            return
+        
+        processed = 0
+        fraud_hits = 0
+        log_timings = self.logger.isEnabledFor(logging.DEBUG)
+        
+        for enriched_data, fraud_prediction, external_analysis in zip(
+                enriched_batch, fraud_predictions, external_analyses):
+            try:
                 # Combine results
                 combined_result = self._combine_fraud_results(fraud_prediction, external_analysis)
                 
-                # Store results
-                self.db.insert_transaction(enriched_data, combined_result)
+                # Hand the result, and the alert row if it is high risk, to the background
+                # writer, which commits them with the rest of its batch
+                high_risk = combined_result['risk_level'] == 'High'
+                self.write_logger.log(
+                    enriched_data, combined_result,
+                    self._alert_row(enriched_data, combined_result) if high_risk else None
+                )
+                self._update_user_aggregates(enriched_data, combined_result)
                 
                 # Check for alerts
-                if combined_result['risk_level'] == 'High':
+                if high_risk:
                     self._queue_alert(enriched_data, combined_result)
                 
-                # Update statistics
-                self.processed_count += 1
+                processed += 1
                 if combined_result['is_fraud']:
-                    self.fraud_detected_count += 1
+                    fraud_hits += 1
                 
-                processing_time = time.time() - start_time
-                self.logger.debug(f"Processed transaction {enriched_data.get('transaction_id')} in {processing_time:.3f}s")
+                if log_timings:
+                    self.logger.debug("Processed transaction %s in %.3fs",
+                                      enriched_data.get('transaction_id'),
+                                      (time.monotonic_ns() - start_ns) / 1e9)
             
             except Exception as e:
                 self.logger.error(f"Error processing transaction: {e}")
+        
+        # Update statistics
+        with self._stats_lock:
+            self.processed_count += processed
+            self.fraud_detected_count += fraud_hits
     
-    def _enrich_transaction_data(self, transaction_data: Dict) -> Dict:
+    def _index_recent_transactions(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """Fetch the most recent transactions and group their amounts and timestamps by user_id"""
+        recent_transactions = self.db.get_recent_transactions(limit=self.recent_window)
+        
+        # Whole columns are converted at once; timestamps parse straight to datetime64
+        # instead of one datetime object per row
+        amounts = np.array([t.get('amount', 0) for t in recent_transactions], dtype=float)
+        timestamps = np.array([t.get('timestamp') for t in recent_transactions], dtype='datetime64[us]')
+        
+        rows_by_user = {}
+        for row, t in enumerate(recent_transactions):
+            rows_by_user.setdefault(t.get('user_id'), []).append(row)
+        
+        return {
+            user_id: {'amount': amounts[rows], 'timestamp': timestamps[rows]}
+            for user_id, rows in rows_by_user.items()
+        }
+    
+    def _enrich_transaction_data(self, transaction_data: Dict, recent_by_user: Dict,
+                                 time_features: Dict, velocity_cutoff: np.datetime64) -> Dict:
         """Enrich transaction data with additional features"""
-        enriched = transaction_data.copy()
+        # Added in place: queued transactions are owned by the processor, so nothing
+        # else sees the change
+        enriched = transaction_data
         
         # Add timestamp features
-        now = datetime.now()
-        enriched['hour_of_day'] = now.hour
-        enriched['day_of_week'] = now.weekday()
-        enriched['is_weekend'] = 1 if now.weekday() >= 5 else 0
+        enriched.update(time_features)
         
         # Add user history features
         user_id = enriched.get('user_id')
@@ -158,33 +285,37 @@ class RealTimeFraudProcessor:
             enriched.update(merchant_stats)
         
         # Add velocity features
-        velocity_stats = self._calculate_velocity_features(enriched)
+        velocity_stats = self._calculate_velocity_features(enriched, recent_by_user, velocity_cutoff)
         enriched.update(velocity_stats)
         
         return enriched
     
     def _get_user_statistics(self, user_id: str) -> Dict:
-        """Get user historical statistics"""
-        # Query recent user transactions
-        recent_transactions = self.db.get_recent_transactions(limit=100)
-        user_transactions = [t for t in recent_transactions.to_dict('records') if t.get('user_id') == user_id]
+        """Get user historical statistics from the running per-user aggregates"""
+        agg = self._user_aggs[self._shard_of(user_id)].get(user_id)
+        count, total_amount, fraud_count = agg.tolist() if agg is not None else (0, 0, 0)
         
-        if not user_transactions:
+        if not count:
             return {
                 'user_transaction_count': 0,
                 'user_avg_amount': 0,
                 'user_fraud_rate': 0
             }
         
-        total_amount = sum(t.get('amount', 0) for t in user_transactions)
-        fraud_count = sum(1 for t in user_transactions if t.get('is_fraud'))
-        
         return {
-            'user_transaction_count': len(user_transactions),
-            'user_avg_amount': total_amount / len(user_transactions),
-            'user_fraud_rate': fraud_count / len(user_transactions)
+            'user_transaction_count': int(count),
+            'user_avg_amount': total_amount / count,
+            'user_fraud_rate': fraud_count / count
         }
     
+    def _update_user_aggregates(self, transaction_data: Dict, fraud_result: Dict):
+        """Fold a scored transaction into its user's running aggregates"""
+        user_id = transaction_data.get('user_id')
+        if not user_id:
+            return
+        agg = self._user_aggs[self._shard_of(user_id)].setdefault(user_id, np.zeros(3))
+        agg += (1, transaction_data.get('amount', 0), 1 if fraud_result['is_fraud'] else 0)
+    
     def _get_merchant_statistics(self, merchant: str) -> Dict:
         """Get merchant historical statistics"""
         # This would typically query a merchant database
@@ -194,18 +325,20 @@ class RealTimeFraudProcessor:
             'merchant_fraud_rate': 0.05
         }
     
-    def _calculate_velocity_features(self, transaction_data: Dict) -> Dict:
-        """Calculate velocity-based features"""
+    def _calculate_velocity_features(self, transaction_data: Dict, recent_by_user: Dict,
+                                     cutoff: np.datetime64) -> Dict:
+        """Calculate velocity-based features from the user's transactions newer than `cutoff`"""
         user_id = transaction_data.get('user_id')
         amount = transaction_data.get('amount', 0)
         
-        # Get recent transactions for velocity calculation
-        recent_transactions = self.db.get_recent_transactions(limit=1000)
-        user_recent = [t for t in recent_transactions.to_dict('records') 
-                      if t.get('user_id') == user_id and 
-                      datetime.fromisoformat(t.get('timestamp', '1970-01-01')) > datetime.now() - timedelta(hours=24)]
+        # The user's recent transactions from the last 24 hours
+        recent = recent_by_user.get(user_id)
+        if recent:
+            user_amounts = recent['amount'][recent['timestamp'] > cutoff]
+        else:
+            user_amounts = np.empty(0)
         
-        if not user_recent:
+        if not user_amounts.size:
             return {
                 'num_transactions_today': 1,
                 'velocity_score': 0.1,
@@ -213,14 +346,11 @@ class RealTimeFraudProcessor:
             }
         
         # Calculate velocity metrics
-        amounts = [t.get('amount', 0) for t in user_recent]
-        avg_amount = sum(amounts) / len(amounts) if amounts else 0
-        
-        amount_deviation = abs(amount - avg_amount) / max(avg_amount, 1) if avg_amount > 0 else 0
-        velocity_score = min(len(user_recent) / 10, 1.0)  # Normalize to 0-1
+        count, avg_amount, amount_deviation = _velocity_kernel(user_amounts, amount)
+        velocity_score = min(count / 10, 1.0)  # Normalize to 0-1
         
         return {
-            'num_transactions_today': len(user_recent) + 1,
+            'num_transactions_today': count + 1,
             'velocity_score': velocity_score,
             'amount_deviation': amount_deviation,
             'avg_transaction_amount': avg_amount
@@ -237,11 +367,10 @@ class RealTimeFraudProcessor:
             external_result['combined_risk_score'] * external_weight
         )
         
-        # Combine risk factors
-        all_risk_factors = []
-        all_risk_factors.extend(internal_result.get('risk_factors', []))
-        all_risk_factors.extend(external_result.get('risk_factors', []))
-        all_risk_factors = list(set(all_risk_factors))  # Remove duplicates
+        # Combine risk factors, dropping duplicates but keeping first-seen order
+        all_risk_factors = list(dict.fromkeys(
+            internal_result.get('risk_factors', []) + external_result.get('risk_factors', [])
+        ))
         
         return {
             'is_fraud': combined_score > 0.5,
@@ -255,12 +384,19 @@ class RealTimeFraudProcessor:
     
     def _get_risk_level(self, probability: float) -> str:
         """Convert probability to risk level"""
-        if probability < 0.3:
-            return 'Low'
-        elif probability < 0.7:
-            return 'Medium'
-        else:
-            return 'High'
+        # bisect_right puts a score equal to a cut point in the higher level
+        return RISK_LEVELS[bisect.bisect_right(RISK_CUTOFFS, probability)]
+    
+    def _alert_row(self, transaction_data: Dict, fraud_result: Dict) -> tuple:
+        """Build the fraud_alerts row for a high-risk transaction"""
+        transaction_id = transaction_data.get('transaction_id')
+        return (
+            transaction_id,
+            'Real-time High Risk Transaction',
+            'Critical',
+            f"Transaction {transaction_id} flagged as high risk "
+            f"(probability: {fraud_result['fraud_probability']:.2%})"
+        )
     
     def _queue_alert(self, transaction_data: Dict, fraud_result: Dict):
         """Queue high-risk transaction for alerting"""
@@ -278,28 +414,20 @@ class RealTimeFraudProcessor:
         """Process fraud alerts"""
         while self.running:
             try:
-                if not self.alert_queue.empty():
-                    alert_data = self.alert_queue.get()
-                    self._send_fraud_alert(alert_data)
-                else:
-                    time.sleep(1)
+                # Wakes as soon as an alert is queued; the timeout only re-checks self.running
+                try:
+                    alert_data = self.alert_queue.get(timeout=self.processing_interval)
+                except Empty:
+                    continue
+                self._send_fraud_alert(alert_data)
             
             except Exception as e:
                 self.logger.error(f"Error in alert processing thread: {e}")
                 time.sleep(1)
     
     def _send_fraud_alert(self, alert_data: Dict):
-        """Send fraud alert notifications"""
+        """Send fraud alert notifications (the alert row is stored by the background writer)"""
         try:
-            # Store alert in database
-            self.db.create_fraud_alert(
-                alert_data['transaction_id'],
-                'Real-time High Risk Transaction',
-                'Critical',
-                f"Transaction {alert_data['transaction_id']} flagged as high risk "
-                f"(probability: {alert_data['fraud_probability']:.2%})"
-            )
-            
             # Send email notification (if configured)
             self._send_email_alert(alert_data)
             
@@ -322,8 +450,12 @@ class RealTimeFraudProcessor:
         webhook_url = os.getenv('FRAUD_ALERT_WEBHOOK_URL')
         if webhook_url:
             try:
-                import requests
-                response = requests.post(webhook_url, json=alert_data, timeout=5)
+                response = self.alert_session.post(
+                    webhook_url,
+                    data=_alert_body(alert_data),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=5
+                )
                 if response.status_code == 200:
                     self.logger.info(f"Webhook alert sent successfully")
                 else:
@@ -337,16 +469,17 @@ class RealTimeFraudProcessor:
             try:
                 time.sleep(60)  # Log stats every minute
                 
+                if not self.logger.isEnabledFor(logging.INFO):
+                    continue
+                
                 uptime = datetime.now() - self.start_time
                 fraud_rate = (self.fraud_detected_count / max(self.processed_count, 1)) * 100
                 
                 self.logger.info(
-                    f"Fraud Processor Stats - "
-                    f"Uptime: {uptime}, "
-                    f"Processed: {self.processed_count}, "
-                    f"Fraud Detected: {self.fraud_detected_count}, "
-                    f"Fraud Rate: {fraud_rate:.2f}%, "
-                    f"Queue Size: {self.transaction_queue.qsize()}"
+                    "Fraud Processor Stats - Uptime: %s, Processed: %d, Fraud Detected: %d, "
+                    "Fraud Rate: %.2f%%, Queue Size: %d",
+                    uptime, self.processed_count, self.fraud_detected_count,
+                    fraud_rate, self._queued_count()
                 )
             
             except Exception as e:
@@ -362,11 +495,9 @@ class RealTimeFraudProcessor:
                 if self.stripe_integration.api_key:
                     recent_charges = self.stripe_integration.get_recent_charges(limit=50, hours_back=1)
                     for charge in recent_charges:
-                        # Process if not already processed
-                        existing = self.db.get_recent_transactions(limit=1000)
-                        existing_ids = [t['transaction_id'] for t in existing.to_dict('records')]
-                        
-                        if charge['transaction_id'] not in existing_ids:
+                        # Process if not already stored; the writer's INSERT OR IGNORE
+                        # drops any that slip past the ID filter
+                        if not self.db.is_known_transaction(charge['transaction_id']):
                             self.add_transaction(charge)
                 
                 self.logger.info("External data sync completed")
@@ -374,6 +505,10 @@ class RealTimeFraudProcessor:
             except Exception as e:
                 self.logger.error(f"Error in sync thread: {e}")
     
+    def _queued_count(self) -> int:
+        """Transactions waiting across all queue shards"""
+        return sum(len(queue) for queue in self.transaction_queues)
+    
     def get_statistics(self) -> Dict:
         """Get current processing statistics"""
         uptime = datetime.now() - self.start_time
@@ -384,7 +519,7 @@ class RealTimeFraudProcessor:
             'processed_count': self.processed_count,
             'fraud_detected_count': self.fraud_detected_count,
             'fraud_rate_percent': fraud_rate,
-            'queue_size': self.transaction_queue.qsize(),
+            'queue_size': self._queued_count(),
             'alert_queue_size': self.alert_queue.qsize(),
             'processing_threads': len(self.processing_threads),
             'alert_threads': len(self.alert_threads)
@@ -392,8 +527,6 @@ class RealTimeFraudProcessor:
 
 # Example usage
 if __name__ == "__main__":
-    import os
-    
     # Configure logging
     logging.basicConfig(level=logging.INFO)
     